@@ -0,0 +1,181 @@
+import gzip
+import hashlib
+import json
+import os
+from datetime import date
+
+from flask import Blueprint, Response, request
+
+from page2 import get_app2_data
+from partitions import DEFAULT_PARTITION
+from user_jobs import load_exposure
+
+try:
+    import brotli
+except ImportError:
+    # brotli is optional; gzip is always available
+    brotli = None
+
+
+# Read-only JSON over app2's data for clients that poll. Responses are GETs with strong ETags
+# tied to the data version, so browsers, CDNs and conditional requests can skip the work.
+api = Blueprint('api', __name__, url_prefix='/api')
+
+MAX_AGE = int(os.environ.get('HOTSPOT_API_MAX_AGE', 300))
+# bodies shorter than this aren't worth compressing
+MIN_COMPRESS = 256
+
+
+class BadRequest(Exception):
+    pass
+
+
+def week_arg():
+    # ?week=<MMWR week> or ?date=YYYY-MM-DD
+    if request.args.get('week'):
+        try:
+            return int(request.args['week'])
+        except ValueError:
+            raise BadRequest('week must be an integer')
+    if request.args.get('date'):
+        return date.fromisoformat(date_arg('date')).isocalendar().week
+    raise BadRequest('week or date is required')
+
+
+def date_arg(name, default=None):
+    value = request.args.get(name, default)
+    if value is None:
+        raise BadRequest(f'{name} is required')
+    try:
+        date.fromisoformat(value[:10])
+    except ValueError:
+        raise BadRequest(f'{name} must be YYYY-MM-DD')
+    return value[:10]
+
+
+def partition_data():
+    # ?city=&disease=&season= pick the partition, Chicago flu by default
+    season = request.args.get('season')
+    if season is not None and not season.isdigit():
+        raise BadRequest('season must be a year')
+    return get_app2_data(request.args.get('city', DEFAULT_PARTITION[0]),
+                         request.args.get('disease', DEFAULT_PARTITION[1]),
+                         season)
+
+
+def error(message, status):
+    return Response(json.dumps({'error': message}), status=status, mimetype='application/json')
+
+
+def encoding():
+    accepted = request.headers.get('Accept-Encoding', '')
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def cached_json(parse, build, private=False):
+    # `parse()` checks the query and returns what `build(data, args)` needs; it runs first so
+    # a bad request is a 400 even when its ETag matches.
+    # ETag: data version + the exact request, per content encoding. A matching If-None-Match
+    # returns 304 without building anything. `private` responses (one user's upload) may only
+    # be cached by that user's browser.
+    try:
+        data = partition_data()
+        args = parse()
+    except BadRequest as e:
+        return error(str(e), 400)
+    if data is None:
+        return error('no data for that city, disease and season', 404)
+    content_encoding = encoding()
+    key = f"{data['version']}:{request.full_path}:{content_encoding}"
+    etag = hashlib.sha256(key.encode()).hexdigest()[:32]
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        try:
+            payload = build(data, args)
+        except BadRequest as e:
+            return error(str(e), 400)
+        body = json.dumps(payload, separators=(',', ':')).encode()
+        response = Response(body, mimetype='application/json')
+        if content_encoding and len(body) >= MIN_COMPRESS:
+            response.set_data(brotli.compress(body) if content_encoding == 'br' else gzip.compress(body))
+            response.headers['Content-Encoding'] = content_encoding
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f"{'private' if private else 'public'}, max-age={MAX_AGE}"
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+@api.route('/ili')
+def ili():
+    # ILI activity level by ZIP for a week; ?zip= narrows it to one ZIP
+    def parse():
+        zip_code = None
+        if request.args.get('zip'):
+            try:
+                zip_code = int(request.args['zip'])
+            except ValueError:
+                raise BadRequest('zip must be an integer')
+        return week_arg(), zip_code
+
+    def build(data, args):
+        week, zip_code = args
+        rows = data['weeks'].risk(week)
+        zip_codes = rows['ZIP_Code'].tolist()
+        levels = rows['ILI'].tolist()
+        if zip_code is not None:
+            pairs = [(z, level) for z, level in zip(zip_codes, levels) if z == zip_code][:1]
+        else:
+            pairs = zip(zip_codes, levels)
+        return {'week': week, 'ili': {str(z): level for z, level in pairs}}
+    return cached_json(parse, build)
+
+
+@api.route('/cases')
+def cases():
+    # lab-tested cases for a week and the change from the week before
+    def build(data, week):
+        weeks = data['weeks']
+        current = weeks.weekly_cases(week)
+        previous = weeks.previous_cases(week)
+        pct_change = None
+        if current is not None and previous is not None:
+            pct_change = round((current - previous) / previous * 100, 2) if previous != 0 else 0
+        return {'week': week, 'cases': current, 'previous_cases': previous, 'pct_change': pct_change}
+    return cached_json(week_arg, build)
+
+
+@api.route('/age')
+def age():
+    # the age group with the highest weekly rate that week
+    def build(data, week):
+        return {'week': week, 'age_category': data['weeks'].top_age.get(week)}
+    return cached_json(week_arg, build)
+
+
+@api.route('/exposure')
+def exposure():
+    # exposure probability for start..end (inclusive); ?upload=<digest> for a scored upload
+    def parse():
+        start = date_arg('start')
+        end = date_arg('end', start)
+        upload = None
+        if request.args.get('upload'):
+            # uploads are scored per partition, see user_jobs.upload_digest
+            upload = load_exposure(request.args['upload'])
+            if upload is None:
+                raise BadRequest('unknown or expired upload')
+        return start, end, upload
+
+    def build(data, args):
+        start, end, upload = args
+        source = upload if upload is not None else data['exposure']
+        probability = source.probability(start, end) if source is not None else None
+        return {'start': start, 'end': end,
+                'probability': round(probability, 2) if probability is not None else None}
+    # one user's upload must not end up in a shared cache
+    return cached_json(parse, build, private=bool(request.args.get('upload')))
@@ -1,32 +1,37 @@
-import numpy as np
-import pandas as pd
-import json
-import plotly.express as px
-import os
-import dash
-from dash import dcc, html, callback, Input, Output, State
-import dash.dependencies as dd
-from datetime import datetime, timedelta
-import re
-import geopandas as gpd
-import requests
-from opencage.geocoder import OpenCageGeocode
-import warnings
-import dash_bootstrap_components as dbc
-from flask import Flask, redirect
-from page1 import run_app_1
-from page2 import run_app_2
+from timings import phase, report
+
+with phase('import'):
+    import os
+    from flask import Flask, redirect
+    from page1 import run_app_1
+    from page2 import run_app_2
+    from api import api
+    from metrics import init_metrics
+    from profiling import init_profiling
 
 # Create Flask server
 server = Flask(__name__)
 
+# cacheable JSON endpoints next to the dashboards, see api.py
+server.register_blueprint(api)
+
 # Redirect root to app_1
 @server.route('/')
 def home():
     return redirect('/app1/')  # Redirect to App 1 at start
 
-app_1 = run_app_1(server)
-app_2 = run_app_2(server)
+with phase('app1'):
+    app_1 = run_app_1(server)
+with phase('app2'):
+    app_2 = run_app_2(server)  # app2's data loads separately, see run_app_2
+
+# request timings and /metrics for Prometheus, see metrics.py
+init_metrics(server, [app_1, app_2])
+# opt-in per-request profiles, see profiling.py
+init_profiling(server)
+
+if os.environ.get('HOTSPOT_APP2_WARMUP', 'thread') != 'thread':
+    report()
 
 # Run server
 if __name__ == "__main__":
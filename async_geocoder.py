@@ -0,0 +1,111 @@
+import asyncio
+import os
+import random
+import time
+
+import aiohttp
+
+
+OPENCAGE_URL = 'https://api.opencagedata.com/geocode/v1/json'
+OPENCAGE_KEY = os.environ.get('OPENCAGE_API_KEY', '50275e53501449ea92d343426825408d')
+
+# statuses worth retrying: rate limited or a transient server side error
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    # allows `rate` acquisitions per second on average, with bursts up to `capacity`. It starts
+    # with one token and no bursts by default: a full bucket plus its refill would send about
+    # twice `rate` in the first second, over a per-second quota
+    def __init__(self, rate, capacity=1):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = min(1.0, self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class GeocodeError(Exception):
+    pass
+
+
+class AsyncGeocoder:
+    def __init__(self, key=OPENCAGE_KEY, url=OPENCAGE_URL, concurrency=8, rate=1.0,
+                 max_retries=4, backoff=0.5, timeout=10):
+        # the free OpenCage plan allows 1 request per second, paid plans raise `rate`
+        self.key = key
+        self.url = url
+        self.concurrency = concurrency
+        self.rate = rate
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.failed = set()
+
+    async def reverse(self, session, bucket, semaphore, lat, lon):
+        params = {'q': f'{lat},{lon}', 'key': self.key, 'no_annotations': 1, 'limit': 1}
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.retries += 1
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1) * (1 + random.random()))
+            await bucket.acquire()
+            async with semaphore:
+                self.requests += 1
+                try:
+                    async with session.get(self.url, params=params) as response:
+                        if response.status in RETRY_STATUSES:
+                            continue
+                        if response.status != 200:
+                            raise GeocodeError(f'reverse geocode failed with HTTP {response.status}')
+                        payload = await response.json()
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    continue
+            results = payload.get('results')
+            if results and 'postcode' in results[0]['components']:
+                return results[0]['components']['postcode']
+            return None
+        raise GeocodeError(f'reverse geocode for {lat},{lon} failed after {self.max_retries + 1} attempts')
+
+    async def reverse_many(self, coordinates):
+        # returns one ZIP (or None) per input coordinate, in input order;
+        # repeated coordinates are only requested once
+        unique = list(dict.fromkeys((float(lat), float(lon)) for lat, lon in coordinates))
+        bucket = TokenBucket(self.rate)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            tasks = [self.reverse(session, bucket, semaphore, lat, lon) for lat, lon in unique]
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        resolved = {}
+        self.failed = set()
+        for coordinate, result in zip(unique, results):
+            if isinstance(result, Exception):
+                # failures come back as None but are listed in `failed` so callers don't cache them
+                self.errors += 1
+                self.failed.add(coordinate)
+                result = None
+            resolved[coordinate] = result
+        return [resolved[(float(lat), float(lon))] for lat, lon in coordinates]
+
+
+def reverse_geocode_many(coordinates, geocoder=None):
+    # blocking entry point for synchronous callers such as get_zip_codes
+    if geocoder is None:
+        geocoder = AsyncGeocoder()
+    return asyncio.run(geocoder.reverse_many(coordinates))
@@ -0,0 +1,184 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import aiohttp
+import numpy as np
+import pandas as pd
+
+from benchmarks.run_benchmarks import map_request
+from partitions import DEFAULT_PARTITION, PARTITIONS, partition_key
+
+
+# Starts `gunicorn app:server` locally in each configuration and replays update_map callbacks
+# from `--concurrency` simultaneous users, then compares throughput and latency:
+#   python -m benchmarks.load_test --configs sync:1 sync:4 gthread:2:8 --concurrency 16 --duration 30
+# A configuration is worker_class:workers[:threads]; other gunicorn settings come from gunicorn.conf.py.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CONFIGS = ['sync:1', 'sync:4', 'gthread:1:8', 'gthread:4:4']
+
+
+def parse_config(text):
+    parts = text.split(':')
+    worker_class = parts[0]
+    workers = int(parts[1]) if len(parts) > 1 else 1
+    threads = int(parts[2]) if len(parts) > 2 else 1
+    return {'name': text, 'worker_class': worker_class, 'workers': workers, 'threads': threads}
+
+
+def week_ranges(city, disease, season):
+    # (first day, last day) of every MMWR week the partition has risk levels for: weeks of its
+    # season and ZIPs in its zip_range, filtered the way datasets.build_datasets does
+    spec = next(spec for spec in PARTITIONS if partition_key(spec) == (city, disease, season))
+    zip_low, zip_high = spec['zip_range']
+    risk = pd.read_csv(os.path.join(ROOT, spec['risk']), usecols=['Week_Start', 'Week_End', 'ZIP_Code'])
+    risk = risk[(risk['ZIP_Code'] > zip_low) & (risk['ZIP_Code'] < zip_high)]
+    weeks = risk[['Week_Start', 'Week_End']].drop_duplicates()
+    ranges = [(datetime.strptime(start, '%m/%d/%Y'), datetime.strptime(end, '%m/%d/%Y'))
+              for start, end in zip(weeks['Week_Start'], weeks['Week_End'])]
+    # update_map picks the partition by the date's year
+    ranges = [(start, end) for start, end in ranges if start.year == season]
+    if not ranges:
+        raise SystemExit(f'no risk levels for {city} {disease} {season}')
+    return ranges
+
+
+def random_request(rng, ranges, city, disease, initial):
+    # a user picking a day in some week; `initial` of them are page loads, which get the
+    # whole figure instead of a patch
+    start, end = ranges[rng.randrange(len(ranges))]
+    day = start + timedelta(days=rng.randint(0, (end - start).days))
+    body = map_request(day.strftime('%Y-%m-%d'), city, disease)
+    if rng.random() < initial:
+        body['inputs'][0]['value'] = day.strftime('%Y-%m-%dT00:00:00')
+        body['changedPropIds'] = []
+    return body
+
+
+def start_server(config, port, log):
+    command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}',
+               '--workers', str(config['workers']), '--worker-class', config['worker_class'],
+               '--threads', str(config['threads']), 'app:server']
+    return subprocess.Popen(command, cwd=ROOT, stdout=log, stderr=log)
+
+
+async def wait_until_up(session, url, process, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with {process.returncode}')
+        try:
+            async with session.get(url) as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f'{url} did not come up')
+
+
+async def drive(session, url, requests, concurrency, duration):
+    # `concurrency` users, each sending its next request as soon as the last one is answered
+    latencies = []
+    sizes = []
+    errors = 0
+    queue = iter(requests)
+    deadline = time.monotonic() + duration
+
+    async def user():
+        nonlocal errors
+        for body in queue:
+            if time.monotonic() > deadline:
+                return
+            started = time.perf_counter()
+            try:
+                async with session.post(url, json=body) as response:
+                    payload = await response.read()
+                    ok = response.status == 200
+            except aiohttp.ClientError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+                sizes.append(len(payload))
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return latencies, sizes, errors, time.perf_counter() - started
+
+
+async def run_config(config, args, ranges, port):
+    rng = random.Random(args.seed)
+    city, disease = args.city, args.disease
+    url = f'http://127.0.0.1:{port}/app2/_dash-update-component'
+    with tempfile.TemporaryFile() as log:
+        process = start_server(config, port, log)
+        try:
+            connector = aiohttp.TCPConnector(limit=args.concurrency)
+            timeout = aiohttp.ClientTimeout(total=60)
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                await wait_until_up(session, f'http://127.0.0.1:{port}/app2/', process)
+                # every worker loads its partition and fills its figure cache before we count anything
+                warmup = [random_request(rng, ranges, city, disease, args.initial) for _ in range(args.warmup)]
+                await drive(session, url, warmup, args.concurrency, float('inf'))
+                requests = (random_request(rng, ranges, city, disease, args.initial) for _ in itertools.count())
+                latencies, sizes, errors, elapsed = await drive(session, url, requests, args.concurrency, args.duration)
+        except RuntimeError:
+            log.seek(0)
+            print(log.read().decode(errors='replace')[-2000:], file=sys.stderr)
+            raise
+        finally:
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+                process.wait(timeout=30)
+
+    latencies = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (float('nan'),) * 3
+    return {'config': config, 'concurrency': args.concurrency, 'requests': len(latencies), 'errors': errors,
+            'seconds': elapsed, 'throughput': len(latencies) / elapsed,
+            'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99,
+            'mean_bytes': float(np.mean(sizes)) if sizes else 0, 'max_bytes': max(sizes, default=0)}
+
+
+def print_results(results):
+    print(f"\n{'config':<16}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'mean B':>9}{'max B':>9}{'errors':>8}")
+    for result in results:
+        print(f"{result['config']['name']:<16}{result['throughput']:>9.1f}{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}"
+              f"{result['p99_ms']:>9.1f}{result['mean_bytes']:>9.0f}{result['max_bytes']:>9}{result['errors']:>8}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load-test the /app2/ map callback against local gunicorn servers')
+    parser.add_argument('--configs', nargs='+', default=DEFAULT_CONFIGS,
+                        help='worker_class:workers[:threads], e.g. sync:4 or gthread:2:8')
+    parser.add_argument('--concurrency', type=int, default=16, help='simultaneous users')
+    parser.add_argument('--duration', type=float, default=20, help='measured seconds per configuration')
+    parser.add_argument('--warmup', type=int, default=200, help='unmeasured requests first')
+    parser.add_argument('--initial', type=float, default=0.1, help='share of page loads (full figure, not a patch)')
+    parser.add_argument('--city', default=DEFAULT_PARTITION[0])
+    parser.add_argument('--disease', default=DEFAULT_PARTITION[1])
+    parser.add_argument('--season', type=int, default=DEFAULT_PARTITION[2])
+    parser.add_argument('--port', type=int, default=8060)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='also write the results as JSON')
+    args = parser.parse_args()
+
+    ranges = week_ranges(args.city, args.disease, args.season)
+    results = []
+    for config in map(parse_config, args.configs):
+        print(f"{config['name']}: {args.concurrency} users for {args.duration:.0f}s", flush=True)
+        results.append(asyncio.run(run_config(config, args, ranges, args.port)))
+    print_results(results)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,228 @@
+import argparse
+import asyncio
+import collections
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from benchmarks.synthetic_timeline import generate
+
+
+# Times the ingestion pipeline on synthetic exports, app startup and the update_map callback,
+# writes the results as JSON and compares them with a baseline run:
+#   python -m benchmarks.run_benchmarks --out bench.json
+#   python -m benchmarks.run_benchmarks --baseline bench.json --fail-over 1.25
+MAP_DATES = ['2024-01-03', '2024-02-20', '2024-03-15', '2024-06-01', '2024-09-20', '2024-10-05']
+
+
+def measure(fn, repeat, warmup=True):
+    # min and median seconds over `repeat` runs, and the last result; one untimed run
+    # first unless `warmup` is off (lazy imports, the resolver's STRtree, allocator growth)
+    if warmup:
+        fn()
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - started)
+    return {'min': min(times), 'median': statistics.median(times)}, result
+
+
+def start_stub_geocoder(port):
+    # the OpenCage stub on a background event loop, so misses are resolved over real HTTP
+    from aiohttp import web
+    from stub_geocoder import make_stub_app
+
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(make_stub_app(latency=0.005))
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', port).start())
+    threading.Thread(target=loop.run_forever, name='stub-geocoder', daemon=True).start()
+    return f'http://127.0.0.1:{port}/geocode/v1/json'
+
+
+def bench_pipeline(sizes, repeat, outside, stub_url):
+    import page2
+    from async_geocoder import AsyncGeocoder
+    from geocode_cache import GeocodeCache
+
+    results = {}
+    for size in sizes:
+        print(f'pipeline: {size} signals', flush=True)
+        export = generate(size, outside=outside)
+        stats = collections.Counter()
+        timings = {}
+        # from a file, streamed as prepare_data and ingest read exports, and from the loaded
+        # document, as uploads are
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'export.json')
+            with open(path, 'w') as f:
+                json.dump(export, f, indent=2, ensure_ascii=False)
+            export_bytes = os.path.getsize(path)
+            timings['get_semantics'], semantics = measure(lambda: page2.get_semantics(path, stats), repeat)
+            timings['get_raw'], raw = measure(lambda: page2.get_raw(path, stats), repeat)
+        timings['get_semantics_loaded'], _ = measure(lambda: page2.get_semantics(export, stats), repeat)
+        timings['get_raw_loaded'], _ = measure(lambda: page2.get_raw(export, stats), repeat)
+        start, end = raw['timestamp'].min(), raw['timestamp'].max()
+        middle = start + (end - start) // 2
+        timings['get_latest'], _ = measure(lambda: page2.get_latest(raw, semantics, start, middle), repeat)
+        timings['get_activity_location'], location_activity = measure(
+            lambda: page2.get_activity_location(raw, semantics), repeat)
+        timings['get_zip_code_activity_local'], _ = measure(
+            lambda: page2.get_zip_code_activity(raw, semantics, location_activity, fallback=False), repeat)
+
+        # with the geocoder fallback: a cold cache pays for the stub round trips, a warm one doesn't
+        with tempfile.TemporaryDirectory() as directory:
+            cache = GeocodeCache(os.path.join(directory, 'geocode.sqlite'))
+            geocoder = AsyncGeocoder(key='stub', url=stub_url, concurrency=32, rate=10000)
+            timings['get_zip_code_activity_cold'], _ = measure(
+                lambda: page2.get_zip_code_activity(raw, semantics, location_activity, True, cache, geocoder), 1, warmup=False)
+            timings['get_zip_code_activity_warm'], _ = measure(
+                lambda: page2.get_zip_code_activity(raw, semantics, location_activity, True, cache, geocoder), repeat)
+            cache.close()
+        results[str(size)] = {'signals': len(raw), 'segments': len(semantics), 'export_bytes': export_bytes,
+                              'matched': len(location_activity), 'geocoder_requests': geocoder.requests,
+                              'timings': timings}
+    return results
+
+
+STARTUP_SCRIPT = '''
+import json, sys, time
+started = time.perf_counter()
+import app
+from timings import STARTUP_PHASES
+print(json.dumps(dict(STARTUP_PHASES, total=time.perf_counter() - started)))
+'''
+
+
+def bench_startup(repeat):
+    # a fresh interpreter per run; the snapshot under .snapshot/ is kept, as on a redeploy
+    env = dict(os.environ, HOTSPOT_APP2_WARMUP='eager')
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], env=env, capture_output=True, text=True, check=True)
+        runs.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    return {name: {'min': min(run[name] for run in runs), 'median': statistics.median(run[name] for run in runs)}
+            for name in runs[0]}
+
+
+def map_request(date, city='Chicago', disease='flu'):
+    return {'output': 'choropleth-map.figure',
+            'outputs': {'id': 'choropleth-map', 'property': 'figure'},
+            'inputs': [{'id': 'date-picker', 'property': 'date', 'value': date},
+                       {'id': 'city-dropdown', 'property': 'value', 'value': city},
+                       {'id': 'disease-dropdown', 'property': 'value', 'value': disease}],
+            'changedPropIds': ['date-picker.date']}
+
+
+def bench_update_map(repeat):
+    # through the Flask test client, so routing, the callback and serialization are all counted
+    os.environ['HOTSPOT_APP2_WARMUP'] = 'eager'
+    os.environ['HOTSPOT_FIGURE_WARM'] = '0'
+    import app
+    import page2
+
+    client = app.server.test_client()
+    client.get('/app2/')
+
+    def post_all():
+        sizes = []
+        for date in MAP_DATES:
+            response = client.post('/app2/_dash-update-component', json=map_request(date))
+            assert response.status_code == 200, response.status_code
+            sizes.append(len(response.data))
+        return sizes
+
+    page2.get_app2_data()['figures'].invalidate()
+    cold, sizes = measure(post_all, 1, warmup=False)
+    warm, _ = measure(post_all, repeat)
+    return {'cold': {name: seconds / len(MAP_DATES) for name, seconds in cold.items()},
+            'warm': {name: seconds / len(MAP_DATES) for name, seconds in warm.items()},
+            'response_bytes': statistics.median(sizes)}
+
+
+def flatten(results, prefix=''):
+    # {'pipeline': {'1000': {'timings': {'get_raw': {'min': ...}}}}} -> {'pipeline.1000.get_raw': ...}
+    # the minimum is compared: it is the least disturbed by whatever else the machine is doing
+    flat = {}
+    for name, value in results.items():
+        if isinstance(value, dict) and 'min' in value:
+            flat[prefix + name] = value['min']
+        elif isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{name}." if name != 'timings' else prefix))
+    return flat
+
+
+def compare(current, baseline, fail_over=None, noise=0.001):
+    # prints current vs baseline; returns the benchmarks slower than `fail_over` x baseline.
+    # Anything under `noise` seconds in both runs is too short to call a regression.
+    now, before = flatten(current['results']), flatten(baseline['results'])
+    print(f"\n{'benchmark':<58}{'baseline':>12}{'current':>12}{'ratio':>8}")
+    regressions = []
+    for name, seconds in now.items():
+        if name not in before:
+            print(f'{name:<58}{"-":>12}{seconds * 1000:>10.2f}ms')
+            continue
+        ratio = seconds / before[name] if before[name] else float('inf')
+        flag = ''
+        if fail_over is not None and ratio > fail_over and max(seconds, before[name]) >= noise:
+            flag = '  <- slower'
+            regressions.append(name)
+        print(f'{name:<58}{before[name] * 1000:>10.2f}ms{seconds * 1000:>10.2f}ms{ratio:>7.2f}x{flag}')
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the Timeline pipeline, app startup and update_map')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='synthetic export sizes in raw signals (up to 1000000)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--outside', type=float, default=0.1, help='share of places that need the geocoder')
+    parser.add_argument('--port', type=int, default=8766, help='port for the stub geocoder')
+    parser.add_argument('--skip', nargs='*', default=[], choices=['pipeline', 'startup', 'update_map'])
+    parser.add_argument('--out', default='benchmark.json')
+    parser.add_argument('--baseline', help='an earlier --out file to compare against')
+    parser.add_argument('--fail-over', type=float, default=None,
+                        help='exit 1 when a timing is this many times the baseline')
+    args = parser.parse_args()
+
+    results = {}
+    if 'pipeline' not in args.skip:
+        results['pipeline'] = bench_pipeline(args.sizes, args.repeat, args.outside, start_stub_geocoder(args.port))
+    if 'startup' not in args.skip:
+        print('startup', flush=True)
+        results['startup'] = bench_startup(args.repeat)
+    if 'update_map' not in args.skip:
+        print('update_map', flush=True)
+        results['update_map'] = bench_update_map(args.repeat)
+
+    current = {'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+               'commit': git_commit(),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'repeat': args.repeat,
+               'results': results}
+    with open(args.out, 'w') as f:
+        json.dump(current, f, indent=2)
+    print(f'wrote {args.out}')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(current, json.load(f), args.fail_over)
+        if regressions:
+            print(f'{len(regressions)} regressions over {args.fail_over}x: {", ".join(regressions)}')
+            sys.exit(1)
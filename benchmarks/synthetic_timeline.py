@@ -0,0 +1,168 @@
+import argparse
+import json
+import random
+from datetime import date, datetime, timedelta, timezone
+
+import shapely
+
+from zip_lookup import get_resolver
+
+
+# Synthetic Google Timeline exports with the shape of a real one: a home, a workplace and a few
+# other places inside the shipped ZIP polygons, days of stays and commutes as semanticSegments,
+# and the position / wifi / activity rawSignals a phone records along the way.
+TRAVEL_ACTIVITIES = ['WALKING', 'IN_VEHICLE', 'IN_PASSENGER_VEHICLE', 'IN_BUS', 'IN_RAIL_VEHICLE', 'ON_BICYCLE']
+TRAVEL_WEIGHTS = [30, 25, 15, 10, 15, 5]
+STILL_ACTIVITIES = ['STILL', 'TILTING', 'UNKNOWN']
+
+
+def utc_offset(day):
+    # US Central: CDT from the second Sunday in March to the first Sunday in November
+    march = date(day.year, 3, 8)
+    november = date(day.year, 11, 1)
+    dst_start = march + timedelta(days=(6 - march.weekday()) % 7)
+    dst_end = november + timedelta(days=(6 - november.weekday()) % 7)
+    return timezone(timedelta(hours=-5 if dst_start <= day < dst_end else -6))
+
+
+def latlng(lat, lon):
+    return f'{lat:.7f}°, {lon:.7f}°'
+
+
+def timestamp(moment):
+    return moment.isoformat(timespec='milliseconds')
+
+
+def random_places(rng, count, outside=0.0):
+    # points inside random ZIP polygons; an `outside` share lands just outside the city,
+    # where only the geocoder fallback can resolve them
+    resolver = get_resolver()
+    bounds = shapely.bounds(resolver.geometries)
+    # north-west of the city, in the suburbs
+    min_lon, max_lat = bounds[:, 0].min(), bounds[:, 3].max()
+    places = []
+    while len(places) < count:
+        if rng.random() < outside:
+            places.append((rng.uniform(max_lat, max_lat + 0.2), rng.uniform(min_lon - 0.2, min_lon)))
+            continue
+        geometry = resolver.geometries[rng.randrange(len(resolver.geometries))]
+        g_min_lon, g_min_lat, g_max_lon, g_max_lat = geometry.bounds
+        lat, lon = rng.uniform(g_min_lat, g_max_lat), rng.uniform(g_min_lon, g_max_lon)
+        if resolver.lookup(lat, lon) is not None:
+            places.append((lat, lon))
+    return places
+
+
+class TimelineWriter:
+    def __init__(self, rng, unknown=0.005):
+        self.rng = rng
+        self.unknown = unknown
+        self.semantic_segments = []
+        self.raw_signals = []
+
+    def stay(self, place, start, end):
+        lat, lon = place
+        self.semantic_segments.append({'startTime': timestamp(start),
+                                       'endTime': timestamp(end),
+                                       'visit': {'hierarchyLevel': 0,
+                                                 'probability': 0.9,
+                                                 'topCandidate': {'placeId': f'place-{lat:.3f}-{lon:.3f}',
+                                                                  'semanticType': 'UNKNOWN',
+                                                                  'probability': 0.8,
+                                                                  'placeLocation': {'latLng': latlng(lat, lon)}}}})
+        moment = start
+        while moment < end:
+            kind = self.rng.random()
+            if kind < self.unknown:
+                self.raw_signals.append({'unknownSignal': {'timestamp': timestamp(moment)}})
+            elif kind < 0.55:
+                self.raw_signals.append({'position': {'LatLng': latlng(lat + self.rng.gauss(0, 0.0002), lon + self.rng.gauss(0, 0.0002)),
+                                                      'accuracyMeters': self.rng.randint(5, 50),
+                                                      'altitudeMeters': 180.0,
+                                                      'source': self.rng.choice(['GPS', 'WIFI', 'CELL']),
+                                                      'timestamp': timestamp(moment)}})
+            elif kind < 0.8:
+                self.raw_signals.append({'wifiScan': {'deliveryTime': timestamp(moment),
+                                                      'devicesRecords': [{'mac': self.rng.getrandbits(48), 'rawRssi': -self.rng.randint(30, 90)}
+                                                                         for _ in range(self.rng.randint(1, 6))]}})
+            else:
+                self.raw_signals.append({'activityRecord': {'probableActivities': [{'type': self.rng.choice(STILL_ACTIVITIES), 'confidence': 0.8}],
+                                                            'timestamp': timestamp(moment)}})
+            moment += timedelta(seconds=self.rng.randint(60, 900))
+
+    def travel(self, origin, destination, start, end):
+        activity = self.rng.choices(TRAVEL_ACTIVITIES, TRAVEL_WEIGHTS)[0]
+        self.semantic_segments.append({'startTime': timestamp(start),
+                                       'endTime': timestamp(end),
+                                       'activity': {'start': {'latLng': latlng(*origin)},
+                                                    'end': {'latLng': latlng(*destination)},
+                                                    'distanceMeters': 5000.0,
+                                                    'probability': 0.9,
+                                                    'topCandidate': {'type': activity, 'probability': 0.8}}})
+        path = []
+        moment = start
+        duration = (end - start).total_seconds()
+        while moment < end:
+            share = (moment - start).total_seconds() / duration
+            lat = origin[0] + (destination[0] - origin[0]) * share
+            lon = origin[1] + (destination[1] - origin[1]) * share
+            path.append({'point': latlng(lat, lon), 'time': timestamp(moment)})
+            if self.rng.random() < 0.5:
+                self.raw_signals.append({'position': {'LatLng': latlng(lat, lon), 'accuracyMeters': 10,
+                                                      'source': 'GPS', 'timestamp': timestamp(moment),
+                                                      'speedMetersPerSecond': 8.0}})
+            else:
+                self.raw_signals.append({'activityRecord': {'probableActivities': [{'type': activity, 'confidence': 0.7},
+                                                                                   {'type': 'STILL', 'confidence': 0.2}],
+                                                            'timestamp': timestamp(moment)}})
+            moment += timedelta(seconds=self.rng.randint(30, 180))
+        # the export repeats the route as its own segment
+        self.semantic_segments.append({'startTime': timestamp(start), 'endTime': timestamp(end), 'timelinePath': path})
+
+
+def generate(signals=10000, start='2024-09-18', seed=0, outside=0.0, places=12):
+    # at least `signals` raw signals, day after day from `start`
+    rng = random.Random(seed)
+    home, work, *others = random_places(rng, max(places, 3), outside)
+    writer = TimelineWriter(rng)
+    day = date.fromisoformat(start)
+    while len(writer.raw_signals) < signals:
+        tz = utc_offset(day)
+        midnight = datetime(day.year, day.month, day.day, tzinfo=tz)
+        leave = midnight + timedelta(minutes=rng.randint(6 * 60 + 30, 9 * 60))
+        writer.stay(home, midnight, leave)
+        stops = [work] if day.weekday() < 5 else []
+        stops += rng.sample(others, rng.randint(0, 2))
+        here, moment = home, leave
+        for stop in stops:
+            arrive = moment + timedelta(minutes=rng.randint(10, 60))
+            writer.travel(here, stop, moment, arrive)
+            moment = arrive + timedelta(minutes=rng.randint(30, 8 * 60 if stop is work else 120))
+            writer.stay(stop, arrive, moment)
+            here = stop
+        if here is not home:
+            arrive = moment + timedelta(minutes=rng.randint(10, 60))
+            writer.travel(here, home, moment, arrive)
+            moment = arrive
+        day += timedelta(days=1)
+        next_midnight = datetime(day.year, day.month, day.day, tzinfo=utc_offset(day))
+        writer.stay(home, moment, next_midnight)
+
+    return {'semanticSegments': writer.semantic_segments,
+            'rawSignals': writer.raw_signals[:signals],
+            'userLocationProfile': {'frequentPlaces': [{'placeId': 'home', 'placeLocation': latlng(*home), 'label': 'HOME'},
+                                                       {'placeId': 'work', 'placeLocation': latlng(*work), 'label': 'WORK'}]}}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic Google Timeline export')
+    parser.add_argument('out')
+    parser.add_argument('--signals', type=int, default=10000)
+    parser.add_argument('--start', default='2024-09-18')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--outside', type=float, default=0.0, help='share of places outside the ZIP polygons')
+    args = parser.parse_args()
+    export = generate(args.signals, args.start, args.seed, args.outside)
+    with open(args.out, 'w') as f:
+        json.dump(export, f, indent=2, ensure_ascii=False)
+    print(f"wrote {args.out}: {len(export['semanticSegments'])} segments, {len(export['rawSignals'])} signals")
@@ -0,0 +1,255 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from exposure import Exposure
+
+
+# One city x disease x season partition: its source files and the filters that used to be
+# hard-coded for Chicago flu. More partitions are listed in partitions.py.
+CHICAGO_FLU_2024 = {
+    'city': 'Chicago',
+    'disease': 'flu',
+    'season': 2024,
+    'surveillance': 'Influenza_Surveillance_Weekly.csv',
+    'risk': 'risk_level.csv',
+    'age': 'FluSurveillance_Custom_Download_Data.csv',
+    'population': 'Chicago_Population_Counts.csv',
+    'population_year': 2021,
+    'population_total_row': 175,  # the citywide total, not a ZIP
+    'zip_range': [60600, 60666],
+    'timeline': 'data_18_24.json',  # sample exposure data, optional
+    'geojson_dir': 'geojson',
+    'highlight_zip': 60616,
+    'center': {'lat': 41.85, 'lon': -87.6298},
+    'zoom': 9,
+}
+SOURCE_KEYS = ('surveillance', 'risk', 'age', 'population', 'timeline')
+
+SNAPSHOT_DIR = os.environ.get('HOTSPOT_SNAPSHOT_DIR', '.snapshot')
+SNAPSHOT_VERSION = 2
+FRAMES = ('df', 'df1', 'age_df')
+
+
+def build_datasets(spec=CHICAGO_FLU_2024):
+    # the cleaned tables behind app2, straight from the partition's source files
+    season = spec['season']
+    zip_low, zip_high = spec['zip_range']
+
+    df = pd.read_csv(spec['surveillance'])
+    df['WEEK_START'] = pd.to_datetime(df['WEEK_START'])
+    df['WEEK_END'] = pd.to_datetime(df['WEEK_END'])
+    df = df[df['WEEK_START'].dt.year >= season]
+    df.sort_values(by='WEEK_START', ascending = False, inplace = True)
+    df.drop(['MMWR_WEEK'], axis = 1, inplace = True)
+    df['week'] = np.arange(len(df) + 1, 1, -1)
+
+    # ZIP_Code_Location (POINT strings) and RECORD_ID are never used, don't parse them
+    df1 = pd.read_csv(spec['risk'], usecols=['MMWR_Week', 'Week_Start', 'Week_End', 'ZIP_Code', 'ILI_Activity_Level'])
+    df1 = df1[(df1['ZIP_Code'] > zip_low) & (df1['ZIP_Code'] < zip_high)]
+    df1['Week_Start'] = pd.to_datetime(df1['Week_Start'], format='%m/%d/%Y')
+    df1['Week_End'] = pd.to_datetime(df1['Week_End'], format='%m/%d/%Y')
+    df1 = df1[df1['Week_Start'].dt.year >= season]
+    df1.rename(columns={'ILI_Activity_Level':'ILI'}, inplace = True) # ili - influenza like illness
+    df1.sort_values(by='Week_Start', inplace = True)
+
+    if spec.get('age'):
+        age_df = pd.read_csv(spec['age'],skiprows = 2)
+        age_df.rename(columns=str.lower, inplace=True)
+        age_df = age_df[['age category','mmwr-year','mmwr-week','cumulative rate','weekly rate']]
+        age_df.replace([np.inf, -np.inf], np.nan, inplace=True)
+        age_df.dropna(inplace = True)
+        age_df['mmwr-year'] = age_df['mmwr-year'].astype('int64')
+        age_df['mmwr-week'] = age_df['mmwr-week'].astype('int64')
+        age_df = age_df[age_df['mmwr-year'] == season]
+        age_df = age_df[~(age_df['age category'] == 'Overall')]
+    else:
+        age_df = pd.DataFrame({'age category': pd.Series(dtype=object), 'mmwr-year': pd.Series(dtype='int64'),
+                               'mmwr-week': pd.Series(dtype='int64'), 'cumulative rate': pd.Series(dtype='float64'),
+                               'weekly rate': pd.Series(dtype='float64')})
+
+    population = pd.read_csv(spec['population'])
+    population = population[population['Year'] == spec['population_year']]
+    population = population[['Geography','Population - Total']]
+    if spec.get('population_total_row') is not None:
+        population.drop(index = spec['population_total_row'], axis = 0, inplace = True)
+    population['Geography'] = population['Geography'].astype('int64')
+    pop_dict = population.set_index('Geography')['Population - Total'].to_dict()
+
+    exposure = None
+    if spec.get('timeline'):
+        with open(spec['timeline'], 'r') as file:
+            json_data = json.load(file)
+        exposure = Exposure.from_records(json_data, pop_dict, exposure_cases(df), max_zip=zip_high)
+
+    return {'df': df.reset_index(drop=True),
+            'df1': df1.reset_index(drop=True),
+            'age_df': age_df.reset_index(drop=True),
+            'pop_dict': pop_dict,
+            'exposure': exposure}
+
+
+def exposure_cases(df):
+    # each record is weighted by the lab-tested cases two weeks before its own week
+    return {int(week) + 2: int(cases) for week, cases in zip(df['week'], df['LAB_FLU_TESTED'])}
+
+
+def partition_name(spec):
+    # 'Chicago', 'flu', 2024 -> 'chicago-flu-2024'
+    return f"{spec['city']}-{spec['disease']}-{spec['season']}".lower().replace(' ', '-')
+
+
+def spec_sources(spec):
+    return [spec[key] for key in SOURCE_KEYS if spec.get(key)]
+
+
+def sources_fingerprint(spec=CHICAGO_FLU_2024, content_hash=None):
+    # the spec plus mtime + size of every source by default; HOTSPOT_SNAPSHOT_HASH=1 hashes
+    # the contents instead
+    if content_hash is None:
+        content_hash = os.environ.get('HOTSPOT_SNAPSHOT_HASH') == '1'
+    digest = hashlib.sha256(f'v{SNAPSHOT_VERSION}'.encode())
+    digest.update(json.dumps(spec, sort_keys=True).encode())
+    for source in spec_sources(spec):
+        digest.update(source.encode())
+        if content_hash:
+            with open(source, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+        else:
+            stat = os.stat(source)
+            digest.update(f'{stat.st_mtime_ns}:{stat.st_size}'.encode())
+    return digest.hexdigest()
+
+
+def _to_array(column):
+    # object columns are strings here; store them fixed width so they can be memory-mapped
+    values = column.to_numpy()
+    if values.dtype == object or isinstance(column.dtype, pd.CategoricalDtype):
+        values = values.astype(str)
+    return values
+
+
+def save_snapshot(datasets, directory, fingerprint):
+    # every writer builds in its own directory next to the snapshot, so workers starting cold
+    # together don't delete each other's half-written files
+    parent = os.path.dirname(directory) or '.'
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=os.path.basename(directory) + '.', suffix='.tmp', dir=parent)
+    try:
+        os.chmod(tmp, 0o755)
+        _write_snapshot(datasets, tmp, fingerprint)
+        _publish(tmp, directory)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _write_snapshot(datasets, tmp, fingerprint):
+    manifest = {'fingerprint': fingerprint, 'frames': {}}
+    for name in FRAMES:
+        columns = []
+        for i, column in enumerate(datasets[name].columns):
+            np.save(os.path.join(tmp, f'{name}.{i}.npy'), _to_array(datasets[name][column]), allow_pickle=False)
+            columns.append(column)
+        manifest['frames'][name] = columns
+    exposure = datasets['exposure']
+    if exposure is not None:
+        np.save(os.path.join(tmp, 'exposure_sums.npy'), exposure.sums, allow_pickle=False)
+        np.save(os.path.join(tmp, 'exposure_counts.npy'), exposure.counts, allow_pickle=False)
+    pop_dict = datasets['pop_dict']
+    np.save(os.path.join(tmp, 'pop_keys.npy'), np.array(list(pop_dict.keys()), dtype='int64'), allow_pickle=False)
+    np.save(os.path.join(tmp, 'pop_values.npy'), np.array(list(pop_dict.values()), dtype='int64'), allow_pickle=False)
+    manifest['exposure_first_day'] = exposure.first_day if exposure is not None else None
+    with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+
+def _publish(tmp, directory):
+    # a finished snapshot goes in with one rename, so readers never see a partial one. rename
+    # can't replace a non-empty directory: the old one is moved aside first, and when another
+    # writer gets its snapshot in between, ours is dropped, being built from the same sources
+    stale = tmp + '.old'
+    try:
+        os.rename(directory, stale)
+    except FileNotFoundError:
+        pass
+    try:
+        os.rename(tmp, directory)
+    except OSError:
+        if not os.path.isdir(directory):
+            raise
+    shutil.rmtree(stale, ignore_errors=True)
+
+
+def load_snapshot(directory, fingerprint, mmap=True):
+    # None when there is no snapshot or it was built from other source files
+    try:
+        with open(os.path.join(directory, 'manifest.json')) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('fingerprint') != fingerprint:
+        return None
+
+    mmap_mode = 'r' if mmap else None
+
+    def load(filename):
+        return np.load(os.path.join(directory, filename), mmap_mode=mmap_mode, allow_pickle=False)
+
+    datasets = {}
+    try:
+        for name, columns in manifest['frames'].items():
+            datasets[name] = pd.DataFrame({column: load(f'{name}.{i}.npy') for i, column in enumerate(columns)})
+        datasets['exposure'] = None
+        if manifest['exposure_first_day'] is not None:
+            datasets['exposure'] = Exposure(manifest['exposure_first_day'], load('exposure_sums.npy'), load('exposure_counts.npy'))
+        datasets['pop_dict'] = dict(zip(load('pop_keys.npy').tolist(), load('pop_values.npy').tolist()))
+    except (OSError, ValueError, KeyError):
+        # a column file missing or cut short: rebuilt like a stale snapshot
+        return None
+    return datasets
+
+
+def share_friendly(datasets):
+    # String columns become categoricals: int codes in one NumPy buffer instead of a Python str
+    # per row, so refcounting in forked workers doesn't dirty the shared pages
+    for name in FRAMES:
+        frame = datasets[name]
+        for column in frame.columns:
+            if frame[column].dtype == object:
+                frame[column] = frame[column].astype('category')
+    return datasets
+
+
+def load_datasets(spec=CHICAGO_FLU_2024, mmap=True):
+    # the partition's snapshot when it matches the sources, otherwise rebuild it
+    directory = os.path.join(SNAPSHOT_DIR, partition_name(spec))
+    fingerprint = sources_fingerprint(spec)
+    datasets = load_snapshot(directory, fingerprint, mmap)
+    if datasets is None:
+        datasets = build_datasets(spec)
+        try:
+            save_snapshot(datasets, directory, fingerprint)
+        except OSError:
+            # a read-only deploy still works, it just rebuilds on every start
+            pass
+    datasets['version'] = fingerprint
+    return share_friendly(datasets)
+
+
+if __name__ == '__main__':
+    # build step: python datasets.py, every partition whose sources are present
+    from partitions import PARTITIONS
+    for spec in PARTITIONS:
+        if not all(os.path.exists(source) for source in spec_sources(spec)):
+            print(f'skipped {partition_name(spec)}: missing sources')
+            continue
+        fingerprint = sources_fingerprint(spec)
+        directory = os.path.join(SNAPSHOT_DIR, partition_name(spec))
+        save_snapshot(build_datasets(spec), directory, fingerprint)
+        print(f'wrote {directory} ({fingerprint[:12]})')
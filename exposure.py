@@ -0,0 +1,135 @@
+from datetime import date
+
+import numpy as np
+
+from timeline_columns import parse_time
+
+
+# weight per minute spent in each activity / record type; types not listed count as UNKNOWN
+FACTORS = {'UNKNOWN': 1.0, 'positionscan': 2.0, 'wifiscan': 2.0, 'STILL': 2.0, 'WALKING': 1.0, 'ON_FOOT': 1.0,
+           'RUNNING': 0.5, 'ON_BICYCLE': 0.5, 'IN_ROAD_VEHICLE': 0.5, 'IN_RAIL_VEHICLE': 5.0, 'IN_VEHICLE': 2.0,
+           'TILTING': 1.0, 'EXITING_VEHICLE': 1.0}
+# a pair whose (minutes, factor, cases/population) add up past this is a tracking gap, not exposure
+MAX_TERM_SUM = 240
+# exposure total that maps to 100%
+SCALE = 600
+DAY_MS = 86400000
+SCAN_TYPES = ('positionscan', 'wifiscan')
+
+
+def to_day(value):
+    # 'YYYY-MM-DD' (optionally with a time), date or day number -> days since 1970-01-01
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    return (value - date(1970, 1, 1)).days
+
+
+def iso_weeks(days):
+    # ISO week number of each day (days since epoch); 1970-01-01 was a Thursday
+    days = np.asarray(days, dtype='int64')
+    thursdays = days - (days + 3) % 7 + 3
+    year_starts = thursdays.astype('datetime64[D]').astype('datetime64[Y]').astype('datetime64[D]').astype('int64')
+    return (thursdays - year_starts) // 7 + 1
+
+
+def run_starts(*columns):
+    # True for the first row of every run of consecutive rows equal in all columns
+    if not len(columns[0]):
+        return np.zeros(0, dtype=bool)
+    keep = np.zeros(len(columns[0]), dtype=bool)
+    keep[0] = True
+    for column in columns:
+        keep[1:] |= column[1:] != column[:-1]
+    return keep
+
+
+def _duplicated(values):
+    # like pandas' duplicated(): True for every repeat after the first occurrence
+    _, first = np.unique(values, return_index=True)
+    duplicated = np.ones(len(values), dtype=bool)
+    duplicated[first] = False
+    return duplicated
+
+
+def pair_terms(epochs, local_days, factors, ratios):
+    # Each record's exposure until the next one on the same local day:
+    # minutes * type factor * cases/population, 0 for a day's last record and for gaps
+    terms = np.zeros(len(epochs), dtype='float64')
+    if len(epochs) < 2:
+        return terms
+    minutes = (epochs[1:] - epochs[:-1]) / 60000
+    same_day = local_days[1:] == local_days[:-1]
+    parts = (minutes, factors[:-1], ratios[:-1])
+    counted = same_day & (parts[0] + parts[1] + parts[2] <= MAX_TERM_SUM)
+    terms[:-1] = np.where(counted, parts[0] * parts[1] * parts[2], 0.0)
+    return terms
+
+
+class Exposure:
+    # Exposure per local day as prefix sums over a dense run of days, so the total for any
+    # date range is one subtraction. sums[k] / counts[k] cover the days before first_day + k.
+    def __init__(self, first_day, sums, counts):
+        self.first_day = int(first_day)
+        self.sums = sums
+        self.counts = counts
+
+    @classmethod
+    def from_terms(cls, local_days, terms):
+        if not len(local_days):
+            return cls(0, np.zeros(1), np.zeros(1, dtype='int64'))
+        first_day = int(local_days.min())
+        offsets = local_days - first_day
+        length = int(offsets.max()) + 1
+        sums = np.zeros(length + 1)
+        counts = np.zeros(length + 1, dtype='int64')
+        sums[1:] = np.cumsum(np.bincount(offsets, weights=terms, minlength=length))
+        counts[1:] = np.cumsum(np.bincount(offsets, minlength=length))
+        return cls(first_day, sums, counts)
+
+    @classmethod
+    def from_records(cls, records, pop_dict, weekly_cases, max_zip=60666):
+        # records: zip_activity_records rows ({'timestamp', 'type', 'zipcode'}), in time order.
+        # weekly_cases maps ISO week -> cases used for exposure in that week.
+        parsed = np.array([parse_time(record['timestamp']) for record in records], dtype='int64').reshape(-1, 2)
+        epochs, offsets = parsed[:, 0], parsed[:, 1]
+        types = np.array([record['type'] for record in records], dtype=object)
+        # records without a ZIP (None) get 0, which has no population and drops out below
+        zip_codes = np.array([int(record['zipcode'] or 0) for record in records], dtype='int64')
+        local_days = (epochs + offsets * 60000) // DAY_MS
+
+        # scans repeating an already seen timestamp add nothing
+        keep = ~(_duplicated(epochs) & np.isin(types, SCAN_TYPES))
+        weeks = iso_weeks(local_days)
+        population = np.array([pop_dict.get(zip_code, 0) for zip_code in zip_codes], dtype='float64')
+        cases = np.array([weekly_cases.get(week, np.nan) for week in weeks.tolist()], dtype='float64')
+        keep &= (zip_codes <= max_zip) & (population > 0) & ~np.isnan(cases)
+
+        epochs, local_days, types, zip_codes = epochs[keep], local_days[keep], types[keep], zip_codes[keep]
+        population, cases = population[keep], cases[keep]
+        # consecutive records in the same ZIP with the same type are one visit
+        first = run_starts(types, zip_codes)
+        epochs, local_days, types = epochs[first], local_days[first], types[first]
+        ratios = cases[first] / population[first]
+
+        factors = np.array([FACTORS.get(kind, FACTORS['UNKNOWN']) for kind in types.tolist()], dtype='float64')
+        return cls.from_terms(local_days, pair_terms(epochs, local_days, factors, ratios))
+
+    def _position(self, day):
+        return min(max(to_day(day) - self.first_day, 0), len(self.sums) - 1)
+
+    def total(self, start, end=None):
+        # (exposure, records) for the days start..end inclusive
+        lo = self._position(start)
+        hi = self._position(to_day(end if end is not None else start) + 1)
+        if hi <= lo:
+            return 0.0, 0
+        return float(self.sums[hi] - self.sums[lo]), int(self.counts[hi] - self.counts[lo])
+
+    def probability(self, start, end=None):
+        # percent, capped below 100; None when there are no records in the range
+        total, records = self.total(start, end)
+        if not records:
+            return None
+        return min(total / SCALE * 100, 99.99)
@@ -0,0 +1,50 @@
+import threading
+from collections import OrderedDict
+
+
+class FigureCache:
+    # LRU of built figures, keyed by (week, display options). `builder(key)` returns the
+    # figure as a plain JSON-ready dict, so a hit skips plotly entirely.
+    # Entries belong to one data version; a new version empties the cache.
+    def __init__(self, builder, maxsize=64):
+        self.builder = builder
+        self.maxsize = maxsize
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        # build outside the lock; two requests racing on one key just build it twice
+        entry = self.builder(key)
+        with self._lock:
+            if version == self.version:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def warm(self, keys, version):
+        for key in keys:
+            self.get(key, version)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self.version = None
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,113 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class GeocodeCache:
+    # On-disk reverse geocode cache keyed by lat/long snapped to `precision` decimals.
+    # A cached None means the provider had no postcode for that spot, so it is not asked again.
+    def __init__(self, path='geocode_cache.sqlite', precision=4, max_entries=100000, ttl=30 * 24 * 3600):
+        self.path = path
+        self.precision = precision
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('''CREATE TABLE IF NOT EXISTS geocode (
+                                  lat INTEGER NOT NULL,
+                                  lon INTEGER NOT NULL,
+                                  precision INTEGER NOT NULL,
+                                  zipcode TEXT,
+                                  created REAL NOT NULL,
+                                  last_used REAL NOT NULL,
+                                  PRIMARY KEY (lat, lon, precision))''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS geocode_last_used ON geocode (last_used)')
+        self._conn.commit()
+        self._size = self._conn.execute('SELECT COUNT(*) FROM geocode').fetchone()[0]
+
+    def key(self, lat, lon):
+        scale = 10 ** self.precision
+        return int(round(float(lat) * scale)), int(round(float(lon) * scale))
+
+    def get(self, lat, lon):
+        # returns (hit, zipcode)
+        lat_key, lon_key = self.key(lat, lon)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute('SELECT zipcode, created FROM geocode WHERE lat = ? AND lon = ? AND precision = ?',
+                                     (lat_key, lon_key, self.precision)).fetchone()
+            if row is None or (self.ttl is not None and now - row[1] > self.ttl):
+                self.misses += 1
+                return False, None
+            self._conn.execute('UPDATE geocode SET last_used = ? WHERE lat = ? AND lon = ? AND precision = ?',
+                               (now, lat_key, lon_key, self.precision))
+            self._conn.commit()
+            self.hits += 1
+            return True, row[0]
+
+    def put(self, lat, lon, zipcode):
+        self.put_many([(lat, lon, zipcode)])
+
+    def put_many(self, entries):
+        now = time.time()
+        rows = []
+        for lat, lon, zipcode in entries:
+            lat_key, lon_key = self.key(lat, lon)
+            rows.append((lat_key, lon_key, self.precision, zipcode, now, now))
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self._conn.commit()
+            # recounted: rowcount includes replaced rows, and other workers share the file
+            self._size = self._conn.execute('SELECT COUNT(*) FROM geocode').fetchone()[0]
+            if self.max_entries is not None and self._size > self.max_entries:
+                self._evict()
+
+    def evict(self):
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        # drop expired rows, then the least recently used ones down to max_entries
+        removed = 0
+        if self.ttl is not None:
+            removed += self._conn.execute('DELETE FROM geocode WHERE created < ?', (time.time() - self.ttl,)).rowcount
+        self._size = self._conn.execute('SELECT COUNT(*) FROM geocode').fetchone()[0]
+        if self.max_entries is not None and self._size > self.max_entries:
+            removed += self._conn.execute('''DELETE FROM geocode WHERE rowid IN (
+                                                 SELECT rowid FROM geocode ORDER BY last_used LIMIT ?)''',
+                                          (self._size - self.max_entries,)).rowcount
+            self._size = self.max_entries
+        self._conn.commit()
+        self.evictions += removed
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'size': self._size}
+
+    def __len__(self):
+        return self._size
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_cache = None
+
+
+def get_geocode_cache():
+    global _cache
+    if _cache is None:
+        _cache = GeocodeCache(path=os.environ.get('HOTSPOT_GEOCODE_CACHE', 'geocode_cache.sqlite'),
+                              precision=int(os.environ.get('HOTSPOT_GEOCODE_PRECISION', 4)))
+    return _cache
@@ -0,0 +1,70 @@
+import gzip
+import hashlib
+import json
+import os
+
+import numpy as np
+import shapely
+from shapely.geometry import mapping, shape
+
+
+# The map only needs each ZIP polygon and its postal code. The source files carry full
+# precision coordinates, a label Point per ZIP and properties the figure never reads.
+TOLERANCE = float(os.environ.get('HOTSPOT_GEOJSON_TOLERANCE', 0.0001))  # degrees, ~10 m
+DECIMALS = int(os.environ.get('HOTSPOT_GEOJSON_DECIMALS', 5))  # ~1 m
+
+
+def read_features(geojson_dir='geojson'):
+    features = []
+    for filename in sorted(os.listdir(geojson_dir)):
+        if filename.endswith('.geojson'):
+            with open(os.path.join(geojson_dir, filename)) as f:
+                features.extend(json.load(f)['features'])
+    return features
+
+
+def reduce_features(features, tolerance=TOLERANCE, decimals=DECIMALS, keep=('postal-code',)):
+    # polygons only, simplified without self-intersections, coordinates rounded,
+    # properties limited to `keep`
+    reduced = []
+    for feature in features:
+        if feature['geometry']['type'] not in ('Polygon', 'MultiPolygon'):
+            continue
+        geometry = shape(feature['geometry'])
+        if tolerance:
+            geometry = geometry.simplify(tolerance, preserve_topology=True)
+        if decimals is not None:
+            geometry = shapely.transform(geometry, lambda coords: np.round(coords, decimals))
+        properties = {key: feature['properties'][key] for key in keep if key in feature['properties']}
+        reduced.append({'type': 'Feature', 'properties': properties, 'geometry': mapping(geometry)})
+    return reduced
+
+
+def to_bytes(geojson):
+    # compact separators; tuples from mapping() serialize as arrays
+    return json.dumps(geojson, separators=(',', ':')).encode()
+
+
+class Geometry:
+    # The reduced FeatureCollection, its serialized body and a content hash for
+    # long-lived cache URLs
+    def __init__(self, geojson_dir='geojson', tolerance=TOLERANCE, decimals=DECIMALS):
+        self.geojson = {'type': 'FeatureCollection',
+                        'features': reduce_features(read_features(geojson_dir), tolerance, decimals)}
+        self.body = to_bytes(self.geojson)
+        self.gzipped = gzip.compress(self.body, 9)
+        self.digest = hashlib.sha256(self.body).hexdigest()[:16]
+
+    def __len__(self):
+        return len(self.body)
+
+
+if __name__ == '__main__':
+    # python geometry.py: payload size before and after
+    features = read_features()
+    original = to_bytes({'type': 'FeatureCollection', 'features': features})
+    print(f'original: {len(features)} features, {len(original)} bytes, {len(gzip.compress(original, 9))} gzipped')
+    for tolerance, decimals in ((0, None), (0, DECIMALS), (TOLERANCE, DECIMALS), (0.0005, 4)):
+        geometry = Geometry(tolerance=tolerance, decimals=decimals)
+        print(f'tolerance={tolerance} decimals={decimals}: {len(geometry.geojson["features"])} features, '
+              f'{len(geometry)} bytes, {len(geometry.gzipped)} gzipped')
@@ -0,0 +1,149 @@
+import argparse
+import collections
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from page2 import get_raw, get_semantics, get_activity_location, get_zip_code_activity, travel_signals
+from timeline_columns import zip_activity_records
+
+
+# Incremental ingestion: only signals newer than the stored watermark are joined, geocoded
+# and appended to weekly JSON Lines partitions (<out_dir>/2024-W38.jsonl). The watermark file
+# also keeps where the start/end alternation of travel signals left off.
+WATERMARK_FILE = '_watermark.json'
+
+
+def _load_state(out_dir):
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_watermark(out_dir):
+    return _load_state(out_dir).get('watermark')
+
+
+def load_travel_parity(out_dir):
+    # travel signals already ingested, mod 2: the next run carries on alternating from there
+    return _load_state(out_dir).get('travel_parity', 0)
+
+
+def save_watermark(out_dir, watermark, travel_parity=0):
+    _write_atomic(os.path.join(out_dir, WATERMARK_FILE),
+                  json.dumps({'watermark': int(watermark), 'travel_parity': int(travel_parity)}))
+
+
+def _write_atomic(path, text):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def partition_names(zip_activity):
+    # ISO week of the local timestamp, e.g. '2024-W38'
+    local = pd.to_datetime(zip_activity['timestamp'] + zip_activity['tz_offset'].astype('int64') * 60000, unit='ms')
+    calendar = local.isocalendar()
+    return [f'{year}-W{week:02d}' for year, week in zip(calendar['year'], calendar['week'])]
+
+
+def ingest(export_path, out_dir, stats=None):
+    # returns the number of records appended
+    if stats is None:
+        stats = collections.Counter()
+    os.makedirs(out_dir, exist_ok=True)
+    watermark = load_watermark(out_dir)
+
+    raw = get_raw(export_path, stats)
+    semantics = get_semantics(export_path, stats)
+    if watermark is not None:
+        raw = raw[raw['timestamp'] > watermark]
+        semantics = semantics[semantics['end'] > watermark]
+    if len(raw) == 0 or len(semantics) == 0:
+        return 0
+
+    # signals past the last finished segment wait for the next run, otherwise moving the
+    # watermark over them would drop them for good. So does one right at its end: it belongs
+    # to the segment starting there, which this run hasn't seen yet
+    horizon = semantics['end'].max()
+    raw = raw[raw['timestamp'] < horizon]
+    raw = raw[np.argsort(raw['timestamp'], kind='stable')]
+    semantics = semantics[np.argsort(semantics['start'], kind='stable')]
+
+    location_activity = get_activity_location(raw, semantics)
+    travel_parity = load_travel_parity(out_dir)
+    zip_activity = get_zip_code_activity(raw, semantics, location_activity, travel_parity=travel_parity)
+    if len(zip_activity):
+        append_partitions(out_dir, zip_activity)
+    if len(raw):
+        travel = travel_signals(raw[location_activity[:, 0]], semantics[location_activity[:, 1]])
+        save_watermark(out_dir, raw['timestamp'].max(), (travel_parity + int(np.count_nonzero(travel))) % 2)
+    return len(zip_activity)
+
+
+def append_partitions(out_dir, zip_activity):
+    partitions = collections.defaultdict(list)
+    for name, record in zip(partition_names(zip_activity), zip_activity_records(zip_activity)):
+        partitions[name].append(record)
+    for name, records in partitions.items():
+        with open(os.path.join(out_dir, name + '.jsonl'), 'a') as f:
+            f.writelines(json.dumps(record) + '\n' for record in records)
+
+
+def read_partitions(out_dir, names=None):
+    records = []
+    for filename in sorted(os.listdir(out_dir)):
+        if not filename.endswith('.jsonl'):
+            continue
+        if names is not None and filename[:-len('.jsonl')] not in names:
+            continue
+        with open(os.path.join(out_dir, filename)) as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return records
+
+
+def compact(out_dir):
+    # rewrite each partition sorted by time with duplicate (timestamp, type) records removed
+    removed = 0
+    for filename in sorted(os.listdir(out_dir)):
+        if not filename.endswith('.jsonl'):
+            continue
+        path = os.path.join(out_dir, filename)
+        with open(path) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        unique = {(record['timestamp'], record['type']): record for record in records}
+        ordered = sorted(unique.values(), key=lambda record: pd.Timestamp(record['timestamp']))
+        removed += len(records) - len(ordered)
+        _write_atomic(path, ''.join(json.dumps(record) + '\n' for record in ordered))
+    return removed
+
+
+def export_json(out_dir, path):
+    # write all partitions as the single JSON list run_app_2 reads (data_18_24.json)
+    records = read_partitions(out_dir)
+    records.sort(key=lambda record: pd.Timestamp(record['timestamp']))
+    _write_atomic(path, json.dumps(records, indent=4))
+    return len(records)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Append new Timeline signals to weekly ZIP activity partitions')
+    parser.add_argument('export', nargs='?', help='Timeline export (JSON)')
+    parser.add_argument('--out', default='zip_activity', help='partition directory, also holds the watermark')
+    parser.add_argument('--compact', action='store_true', help='sort and deduplicate the partitions')
+    parser.add_argument('--export-json', help='also write all partitions to this JSON file, e.g. data_18_24.json')
+    args = parser.parse_args()
+
+    if args.export:
+        stats = collections.Counter()
+        appended = ingest(args.export, args.out, stats)
+        print(f'appended {appended} records, watermark {load_watermark(args.out)}, {dict(stats)}')
+    if args.compact:
+        print(f'compaction removed {compact(args.out)} duplicate records')
+    if args.export_json:
+        print(f'wrote {export_json(args.out, args.export_json)} records to {args.export_json}')
@@ -0,0 +1,73 @@
+import heapq
+
+import numpy as np
+
+
+def interval_join(points, starts, ends, closed='both', overlap='latest'):
+    # Map each point (epoch) to the interval(s) [starts[i], ends[i]] containing it.
+    #   closed:  'both' [start, end], 'left' [start, end), 'right' (start, end], 'neither' (start, end)
+    #   overlap: 'latest' -> at most one interval per point, the one that started last, so a
+    #            point on an adjacent boundary belongs to the segment starting there;
+    #            'all' -> every containing interval
+    # Returns (point_idx, interval_idx) int arrays ordered by point, then interval start.
+    points = np.asarray(points, dtype='int64')
+    starts = np.asarray(starts, dtype='int64')
+    ends = np.asarray(ends, dtype='int64')
+    if len(points) == 0 or len(starts) == 0:
+        return np.empty(0, dtype='int64'), np.empty(0, dtype='int64')
+
+    start_side = 'right' if closed in ('both', 'left') else 'left'
+    end_inclusive = closed in ('both', 'right')
+
+    point_order = np.argsort(points, kind='stable')
+    sorted_points = points[point_order]
+    interval_order = np.argsort(starts, kind='stable')
+    sorted_starts = starts[interval_order]
+    sorted_ends = ends[interval_order]
+
+    if overlap == 'latest' and np.all(sorted_ends[1:] >= sorted_ends[:-1]):
+        # no interval nests inside an earlier one, so the last interval starting at or
+        # before a point is the only candidate: one searchsorted, O((n + m) log m)
+        candidate = np.searchsorted(sorted_starts, sorted_points, side=start_side) - 1
+        valid = candidate >= 0
+        candidate_end = sorted_ends[np.maximum(candidate, 0)]
+        inside = sorted_points <= candidate_end if end_inclusive else sorted_points < candidate_end
+        matched = valid & inside
+        return point_order[matched], interval_order[candidate[matched]]
+
+    point_idx, interval_idx = _sweep(sorted_points, sorted_starts, sorted_ends, start_side, end_inclusive, overlap)
+    return point_order[point_idx], interval_order[interval_idx]
+
+
+def _sweep(points, starts, ends, start_side, end_inclusive, overlap):
+    # two-pointer sweep for nested/overlapping intervals; points and intervals sorted by time
+    def started(k, t):
+        return starts[k] <= t if start_side == 'right' else starts[k] < t
+
+    def covers(k, t):
+        return t <= ends[k] if end_inclusive else t < ends[k]
+
+    point_idx = []
+    interval_idx = []
+    active = []
+    k = 0
+    for i, t in enumerate(points):
+        while k < len(starts) and started(k, t):
+            if overlap == 'latest':
+                heapq.heappush(active, -k)
+            else:
+                active.append(k)
+            k += 1
+        if overlap == 'latest':
+            # points only move forward, so an interval that no longer covers the head never will
+            while active and not covers(-active[0], t):
+                heapq.heappop(active)
+            if active:
+                point_idx.append(i)
+                interval_idx.append(-active[0])
+        else:
+            active = [j for j in active if covers(j, t)]
+            for j in active:
+                point_idx.append(i)
+                interval_idx.append(j)
+    return np.array(point_idx, dtype='int64'), np.array(interval_idx, dtype='int64')
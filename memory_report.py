@@ -0,0 +1,98 @@
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Starts gunicorn with and without preload, drives /app2/ callbacks through every worker and
+# reports resident (RSS), proportional (PSS) and unique (USS) memory per worker process.
+CALLBACK_BODY = {'output': 'choropleth-map.figure',
+                 'outputs': {'id': 'choropleth-map', 'property': 'figure'},
+                 'inputs': [{'id': 'date-picker', 'property': 'date', 'value': '2024-03-15'},
+                            {'id': 'city-dropdown', 'property': 'value', 'value': 'Chicago'},
+                            {'id': 'disease-dropdown', 'property': 'value', 'value': 'flu'}],
+                 'changedPropIds': ['date-picker.date']}
+
+
+def smaps(pid):
+    # kB values from /proc/<pid>/smaps_rollup
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1])
+    return {'rss': values['Rss'] / 1024,
+            'pss': values['Pss'] / 1024,
+            'uss': (values['Private_Clean'] + values['Private_Dirty']) / 1024}
+
+
+def children(pid):
+    pids = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        pids.append(int(entry))
+            except (OSError, IndexError):
+                pass
+    return pids
+
+
+def wait_until_up(url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=2).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} did not come up')
+
+
+def post_callback(port):
+    request = urllib.request.Request(f'http://127.0.0.1:{port}/app2/_dash-update-component',
+                                     data=json.dumps(CALLBACK_BODY).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    urllib.request.urlopen(request, timeout=30).read()
+
+
+def measure(preload, workers, port, requests):
+    env = dict(os.environ, HOTSPOT_PRELOAD='1' if preload else '0', WEB_CONCURRENCY=str(workers), PORT=str(port))
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:server'],
+                               env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up(f'http://127.0.0.1:{port}/app1/')
+        # enough concurrent requests that every worker has loaded its data and served the map
+        with ThreadPoolExecutor(workers * 2) as pool:
+            list(pool.map(lambda _: post_callback(port), range(requests)))
+        time.sleep(1)
+        worker_stats = [smaps(pid) for pid in children(process.pid)]
+        master = smaps(process.pid)
+    finally:
+        process.send_signal(signal.SIGTERM)
+        process.wait(timeout=30)
+    return master, worker_stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare gunicorn worker memory with and without preload')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    for preload in (False, True):
+        master, worker_stats = measure(preload, args.workers, args.port, args.requests)
+        count = len(worker_stats)
+        average = {key: sum(stats[key] for stats in worker_stats) / count for key in ('rss', 'pss', 'uss')}
+        total = master['pss'] + sum(stats['pss'] for stats in worker_stats)
+        print(f"preload={'on ' if preload else 'off'} {count} workers: per worker RSS {average['rss']:.1f} MB, "
+              f"PSS {average['pss']:.1f} MB, USS {average['uss']:.1f} MB; master RSS {master['rss']:.1f} MB; "
+              f"total PSS {total:.1f} MB")
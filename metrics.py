@@ -0,0 +1,322 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+import psutil
+from flask import Response, g, request
+
+from timings import STARTUP_PHASES
+
+
+# Prometheus text-format metrics at /metrics. Every thread counts into its own shard, so
+# recording is a dict lookup and an add with no lock and no contention; shards are summed
+# when /metrics is scraped.
+#
+# Each gunicorn worker has its own counters. With HOTSPOT_METRICS_DIR set, workers also write
+# them to <dir>/<pid>.json every HOTSPOT_METRICS_FLUSH seconds from a background thread and a
+# scrape of any worker adds up all of them; without it a scrape shows the worker that answered.
+METRICS_DIR = os.environ.get('HOTSPOT_METRICS_DIR')
+FLUSH_INTERVAL = float(os.environ.get('HOTSPOT_METRICS_FLUSH', 5))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+_metrics = []
+_shards_lock = threading.Lock()
+_flusher_pid = None
+
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(names, escaped)) + '}'
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _add(total, values):
+    for labels, numbers in values.items():
+        if labels in total:
+            total[labels] = [a + b for a, b in zip(total[labels], numbers)]
+        else:
+            total[labels] = list(numbers)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._local = threading.local()
+        self._shards = []  # (thread, values) per thread that recorded something
+        self._retired = {}  # values of threads that have exited
+        _metrics.append(self)
+
+    def _values(self):
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            with _shards_lock:
+                self._shards.append((threading.current_thread(), values))
+                if len(self._shards) > 64:
+                    # the dev server starts a thread per request; fold the finished ones
+                    self._fold()
+            return values
+
+    def _fold(self):
+        live = []
+        for thread, values in self._shards:
+            if thread.is_alive():
+                live.append((thread, values))
+            else:
+                _add(self._retired, values)
+        self._shards = live
+
+    def collect(self):
+        # {label values: numbers}, summed over threads
+        with _shards_lock:
+            self._fold()
+            total = {labels: list(numbers) for labels, numbers in self._retired.items()}
+            shards = [dict(values) for _, values in self._shards]
+        for values in shards:
+            _add(total, values)
+        return total
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        values = self._values()
+        numbers = values.get(labels)
+        if numbers is None:
+            values[labels] = [amount]
+        else:
+            numbers[0] += amount
+
+    def format(self, labels, numbers):
+        return [f'{self.name}_total{_label_text(self.labels, labels)} {_number(numbers[0])}']
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        # numbers: one count per bucket plus +Inf, then the sum
+        values = self._values()
+        numbers = values.get(labels)
+        if numbers is None:
+            numbers = values[labels] = [0] * (len(self.buckets) + 2)
+        numbers[bisect_left(self.buckets, value)] += 1
+        numbers[-1] += value
+
+    def format(self, labels, numbers):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), numbers):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{_label_text(self.labels + ("le",), labels + (bound,))} {cumulative}')
+        lines.append(f'{self.name}_sum{_label_text(self.labels, labels)} {_number(numbers[-1])}')
+        lines.append(f'{self.name}_count{_label_text(self.labels, labels)} {cumulative}')
+        return lines
+
+
+class Gauge(Metric):
+    # read when scraped: `read()` returns {label values: value} for this process
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels, read):
+        super().__init__(name, help, ('worker',) + tuple(labels))
+        self.read = read
+
+    def collect(self):
+        pid = str(os.getpid())
+        return {(pid,) + tuple(labels): [value] for labels, value in self.read().items()}
+
+    def format(self, labels, numbers):
+        return [f'{self.name}{_label_text(self.labels, labels)} {_number(numbers[0])}']
+
+
+@contextmanager
+def timed(histogram, *labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - started, *labels)
+
+
+def callback_returned(callback):
+    # marks the end of the callback body; what's left of the request (Dash encoding the
+    # return value as JSON) is recorded as the callback's 'response' stage
+    g.metrics_returned = (callback, time.perf_counter())
+
+
+CALLBACK_SECONDS = Histogram('hotspot_callback_seconds', 'Dash callback request latency', ['callback'])
+CALLBACK_BYTES = Histogram('hotspot_callback_response_bytes', 'Dash callback response size', ['callback'],
+                           buckets=SIZE_BUCKETS)
+REQUEST_SECONDS = Histogram('hotspot_request_seconds', 'Latency of other HTTP requests', ['endpoint'])
+STAGE_SECONDS = Histogram('hotspot_stage_seconds', 'Time spent in each stage of a callback', ['callback', 'stage'])
+ZIP_LOOKUPS = Counter('hotspot_zip_lookups', 'Coordinates resolved to a ZIP code, by where the answer came from',
+                      ['source'])
+GEOCODER_REQUESTS = Counter('hotspot_geocoder_requests', 'HTTP requests sent to the reverse geocoder')
+GEOCODER_RETRIES = Counter('hotspot_geocoder_retries', 'Reverse geocoder requests retried')
+GEOCODER_ERRORS = Counter('hotspot_geocoder_errors', 'Coordinates the reverse geocoder failed to resolve')
+GEOCODER_SECONDS = Histogram('hotspot_geocoder_batch_seconds', 'Time to reverse geocode one batch of cache misses')
+STARTUP_SECONDS = Gauge('hotspot_startup_phase_seconds', 'Duration of each startup phase', ['phase'],
+                        lambda: {(name,): seconds for name, seconds in STARTUP_PHASES.items()})
+RSS_BYTES = Gauge('process_resident_memory_bytes', 'Resident memory of the worker process', [],
+                  lambda: {(): psutil.Process().memory_info().rss})
+
+
+def _forget():
+    # a forked worker starts from zero: what the master recorded while preloading isn't its own
+    global _shards_lock
+    _shards_lock = threading.Lock()
+    for metric in _metrics:
+        metric._local = threading.local()
+        metric._shards = []
+        metric._retired = {}
+
+
+os.register_at_fork(after_in_child=_forget)
+
+
+def snapshot():
+    return {metric.name: metric.collect() for metric in _metrics}
+
+
+def flush():
+    # this worker's values for the other workers' scrapes
+    path = os.path.join(METRICS_DIR, f'{os.getpid()}.json')
+    state = {name: [[list(labels), numbers] for labels, numbers in values.items()]
+             for name, values in snapshot().items()}
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(path + '.tmp', path)
+
+
+def _flush_forever():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            flush()
+        except OSError:
+            pass
+
+
+def start_flusher():
+    # once per process; a forked worker doesn't inherit the master's thread
+    global _flusher_pid
+    if METRICS_DIR and _flusher_pid != os.getpid():
+        _flusher_pid = os.getpid()
+        threading.Thread(target=_flush_forever, name='metrics-flush', daemon=True).start()
+        # and a last time when a worker is recycled, so its final counts aren't lost
+        atexit.register(flush)
+
+
+def clear_worker_files():
+    # counts from a previous server run would be added again; gunicorn.conf.py calls this on start
+    if METRICS_DIR:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        for path in glob.glob(os.path.join(METRICS_DIR, '*.json')):
+            os.remove(path)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def collect_all():
+    total = snapshot()
+    if not METRICS_DIR:
+        return total
+    for path in glob.glob(os.path.join(METRICS_DIR, '*.json')):
+        pid = int(os.path.basename(path)[:-5])
+        if pid == os.getpid():
+            continue
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            continue
+        alive = _alive(pid)
+        for metric in _metrics:
+            if metric.kind == 'gauge' and not alive:
+                # an exited worker's counts still count, its memory doesn't
+                continue
+            values = {tuple(labels): numbers for labels, numbers in state.get(metric.name, [])}
+            _add(total.setdefault(metric.name, {}), values)
+    return total
+
+
+def render():
+    values = collect_all()
+    lines = []
+    for metric in _metrics:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        for labels, numbers in sorted(values.get(metric.name, {}).items()):
+            lines.extend(metric.format(labels, numbers))
+    return '\n'.join(lines) + '\n'
+
+
+def init_metrics(server, dash_apps):
+    # times every request, names Dash callbacks by their function and serves /metrics
+    callbacks = {}
+    for dash_app in dash_apps:
+        prefix = dash_app.config.routes_pathname_prefix
+        for output, callback in dash_app.callback_map.items():
+            if 'callback' in callback:
+                callbacks[(prefix, output)] = callback['callback'].__name__
+
+    def callback_name():
+        body = request.get_json(silent=True) or {}
+        prefix = request.path[:-len('_dash-update-component')]
+        return callbacks.get((prefix, body.get('output')), 'unknown')
+
+    @server.before_request
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @server.after_request
+    def record(response):
+        now = time.perf_counter()
+        seconds = now - g.pop('metrics_started', now)
+        if 'metrics_returned' in g:
+            callback, returned = g.pop('metrics_returned')
+            STAGE_SECONDS.observe(now - returned, callback, 'response')
+        if request.path.endswith('/_dash-update-component'):
+            callback = callback_name()
+            CALLBACK_SECONDS.observe(seconds, callback)
+            CALLBACK_BYTES.observe(response.content_length or 0, callback)
+        elif request.endpoint != 'metrics':
+            REQUEST_SECONDS.observe(seconds, request.endpoint or 'not_found')
+        start_flusher()
+        return response
+
+    def metrics():
+        return Response(render(), mimetype='text/plain; version=0.0.4')
+
+    if METRICS_DIR:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+    server.add_url_rule('/metrics', 'metrics', metrics)
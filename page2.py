@@ -1,287 +1,393 @@
 import numpy as np
-import pandas as pd
 import json
-import plotly.express as px
+import collections
 import os
+import threading
 import dash
-from dash import dcc, html, callback, Input, Output, State
-import dash.dependencies as dd
-from datetime import datetime, timedelta
-import re
-import geopandas as gpd
-import requests
-from opencage.geocoder import OpenCageGeocode
+from dash import dcc, html, Input, Output, State
+from datetime import datetime
 import warnings
 import dash_bootstrap_components as dbc
+from flask import Response, abort, request
+from geocode_cache import get_geocode_cache
+from datasets import CHICAGO_FLU_2024, exposure_cases, load_datasets, partition_name
+from figure_cache import FigureCache
+from partitions import DEFAULT_PARTITION, PARTITIONS, PartitionStore
+from week_index import WeekIndex
+from user_jobs import decode_upload, get_background_manager, load_exposure, save_exposure, score_export, upload_digest
+from timeline_stream import convert, iter_semantics, iter_raw
+from time_window import TimeIndex
+from interval_join import interval_join
+from timeline_columns import RawKind, SemanticKind, ZIP_ACTIVITY_DTYPE, activity_code, raw_array, semantics_array
+from timings import phase, report
+from metrics import (GEOCODER_ERRORS, GEOCODER_REQUESTS, GEOCODER_RETRIES, GEOCODER_SECONDS, STAGE_SECONDS,
+                     ZIP_LOOKUPS, callback_returned, timed)
 
 
 geojson_dir = 'geojson'
 
-# Combine all individual GeoJSON files into one GeoJSON object
-all_geojson = {
-    "type": "FeatureCollection",
-    "features": []
-}
-
-# Iterate over each file in the directory and add to the combined GeoJSON
-for filename in os.listdir(geojson_dir):
-    if filename.endswith('.geojson'):
-        with open(os.path.join(geojson_dir, filename)) as f:
-            geojson_data = json.load(f)
-            all_geojson['features'].extend(geojson_data['features'])
-
-def get_semantics(data):
-    semantics = []
-    for i in data['semanticSegments']:
-        if 'timelinePath' in i.keys():
-            continue
-        elif 'visit' in i.keys():
-            temp_dict = {'start':i['startTime'],
-                         'end':i['endTime'],
-                         'lat':i['visit']['topCandidate']['placeLocation']['latLng'].split(',')[0].replace('°', ''),
-                         'long':i['visit']['topCandidate']['placeLocation']['latLng'].split(',')[1].replace('°', ''),
-                         'type':'stay'}
-            semantics.append(temp_dict)
-        elif 'activity' in i.keys():
-            temp_dict = {'start':i['startTime'],
-                         'end':i['endTime'],
-                         'activity':i['activity']['topCandidate']['type'],
-                         'start_lat':i['activity']['start']['latLng'].split(',')[0].replace('°', ''),
-                         'end_lat':i['activity']['end']['latLng'].split(',')[0].replace('°', ''),
-                         'start_long':i['activity']['start']['latLng'].split(',')[1].replace('°', ''),
-                         'end_long':i['activity']['end']['latLng'].split(',')[1].replace('°', ''),
-                         'type':'travel'}
-            semantics.append(temp_dict)
-        else:
-            print(i)
-            break
-    return semantics
-
-def get_raw(data):
-    raw = []
-    for i in data['rawSignals']:
-        if 'activityRecord' in i.keys():
-            temp_dict = {'activity':i['activityRecord']['probableActivities'][0]['type'],
-                         'timestamp':i['activityRecord']['timestamp'],
-                         'type':'travel'}
-            raw.append(temp_dict)
-        elif 'wifiScan' in i.keys():
-            temp_dict = {'timestamp':i['wifiScan']['deliveryTime'],
-                         'type':'wifiscan'}
-            raw.append(temp_dict)
-        elif 'position' in i.keys():
-            temp_dict = {'timestamp':i['position']['timestamp'],
-                         'lat':i['position']['LatLng'].split(',')[0].replace('°', ''),
-                         'long':i['position']['LatLng'].split(',')[1].replace('°', ''),
-                         'type':'positionscan'}
-            raw.append(temp_dict)
-        else:
-            print(i)
-            break
-    return raw
-
-from datetime import datetime
-
-def get_latest(raw, semantics, start_time, end_time):
-    start_time = datetime.strptime(start_time, '%Y-%m-%dT%H:%M:%S.%f%z')
-    end_time = datetime.strptime(end_time, '%Y-%m-%dT%H:%M:%S.%f%z')
-
-    updated_raw_start_index = len(raw)  # Default to all entries
-    updated_raw_end_index = -1  # Default to no entries
-    updated_semantics_start_index = len(semantics)  # Default to all entries
-    updated_semantics_end_index = -1  # Default to no entries
-
-    # Calculate start index for raw
-    for i in range(len(raw)):
-        if datetime.strptime(raw[i]['timestamp'], '%Y-%m-%dT%H:%M:%S.%f%z') >= start_time:
-            updated_raw_start_index = i
-            break
-
-    # Calculate start index for semantics
-    for i in range(len(semantics)):
-        if datetime.strptime(semantics[i]['start'], '%Y-%m-%dT%H:%M:%S.%f%z') >= start_time:
-            updated_semantics_start_index = i
-            break
-
-    # Calculate end index for raw
-    for i in range(len(raw) - 1, -1, -1):  # Adjusted to include index 0
-        if datetime.strptime(raw[i]['timestamp'], '%Y-%m-%dT%H:%M:%S.%f%z') <= end_time:
-            updated_raw_end_index = i - 1
-            break
-
-    # Calculate end index for semantics
-    for i in range(len(semantics) - 1, -1, -1):  # Adjusted to include index 0
-        if datetime.strptime(semantics[i]['start'], '%Y-%m-%dT%H:%M:%S.%f%z') <= end_time:
-            updated_semantics_end_index = i - 1
-            break
-
-    # Return slices, handling cases where no valid indices were found
-    raw_result = raw[updated_raw_start_index:updated_raw_end_index + 1] if updated_raw_end_index >= 0 else []
-    semantics_result = semantics[updated_semantics_start_index:updated_semantics_end_index + 1] if updated_semantics_end_index >= 0 else []
-    
-    return raw_result, semantics_result
-
-def get_activity_location(updated_raw, updated_semantics):
-    time_activity = []
-    n = 0
-    for i in range(len(updated_semantics)):
-        for j in range(n,len(updated_raw),1):
-            if datetime.strptime(updated_raw[j]['timestamp'], '%Y-%m-%dT%H:%M:%S.%f%z') >= datetime.strptime(updated_semantics[i]['start'], '%Y-%m-%dT%H:%M:%S.%f%z') and datetime.strptime(updated_raw[j]['timestamp'], '%Y-%m-%dT%H:%M:%S.%f%z') <= datetime.strptime(updated_semantics[i]['end'], '%Y-%m-%dT%H:%M:%S.%f%z'):
-                time_activity.append((j,i)) # (updated_raw, updated_semantics)
-                n = n + 1
-    return time_activity
-
-
-def get_zip_code_activity(updated_raw, updated_semantics, location_activity):
-    n = 1
-    zip_activity = []
-    flag = 0
-    for i in location_activity:
-        print(n)
-        n = n + 1
-        if len(updated_raw[i[0]].keys()) == 4: # position scan
-            temp_dict = {'timestamp':updated_raw[i[0]]['timestamp'],
-                         'type':updated_raw[i[0]]['type'],
-                         'zipcode':get_zip_code(updated_raw[i[0]]['lat'],updated_raw[i[0]]['long'])}
-            zip_activity.append(temp_dict)
-        elif len(updated_raw[i[0]].keys()) == 2: # wifi scan
-            if len(updated_semantics[i[1]]) == 5:
-                temp_dict = {'timestamp':updated_raw[i[0]]['timestamp'],
-                             'type':updated_raw[i[0]]['type'],
-                             'zipcode':get_zip_code(updated_semantics[i[1]]['lat'],updated_semantics[i[1]]['long'])}
-                zip_activity.append(temp_dict)
-            else:
-                if flag == 0:
-                    temp_dict = {'timestamp':updated_raw[i[0]]['timestamp'],
-                                 'type':updated_raw[i[0]]['type'],
-                                 'zipcode':get_zip_code(updated_semantics[i[1]]['start_lat'],updated_semantics[i[1]]['start_long'])}
-                    flag = 1
-                    zip_activity.append(temp_dict)
-                else:
-                    temp_dict = {'timestamp':updated_raw[i[0]]['timestamp'],
-                                 'type':updated_raw[i[0]]['type'],
-                                 'zipcode':get_zip_code(updated_semantics[i[1]]['end_lat'],updated_semantics[i[1]]['end_long'])}
-                    flag = 0
-                    zip_activity.append(temp_dict)
-        elif len(updated_raw[i[0]].keys()) == 3: # activity record
-            if len(updated_semantics[i[1]]) == 5:
-                temp_dict = {'timestamp':updated_raw[i[0]]['timestamp'],
-                             'type':updated_raw[i[0]]['activity'],
-                             'zipcode':get_zip_code(updated_semantics[i[1]]['lat'],updated_semantics[i[1]]['long'])}
-                zip_activity.append(temp_dict)
-            else:
-                if flag == 0:
-                    temp_dict = {'timestamp':updated_raw[i[0]]['timestamp'],
-                                 'type':updated_raw[i[0]]['activity'],
-                                 'zipcode':get_zip_code(updated_semantics[i[1]]['start_lat'],updated_semantics[i[1]]['start_long'])}
-                    flag = 1
-                    zip_activity.append(temp_dict)
-                else:
-                    temp_dict = {'timestamp':updated_raw[i[0]]['timestamp'],
-                                 'type':updated_raw[i[0]]['activity'],
-                                 'zipcode':get_zip_code(updated_semantics[i[1]]['end_lat'],updated_semantics[i[1]]['end_long'])}
-                    flag = 0
-                    zip_activity.append(temp_dict)
-    return zip_activity
-
-def get_zip_code(lat, lon):
-    key = '50275e53501449ea92d343426825408d'
-    geocoder = OpenCageGeocode(key)
-    
-    results = geocoder.reverse_geocode(lat, lon)
-    
-    if results and 'postcode' in results[0]['components']:
-        zip_code = results[0]['components']['postcode']
-        return zip_code
+_geometries = {}
+_geometries_lock = threading.Lock()
+
+def get_geometry(directory=geojson_dir):
+    # The ZIP polygons reduced for the map (see geometry.py), built once per directory on first use
+    from geometry import Geometry
+
+    geometry = _geometries.get(directory)
+    if geometry is None:
+        with _geometries_lock:
+            geometry = _geometries.get(directory)
+            if geometry is None:
+                geometry = _geometries[directory] = Geometry(directory)
+    return geometry
+
+# HOTSPOT_GEOJSON_URL=0 embeds the geometry in every figure instead of serving it once
+GEOJSON_URL = os.environ.get('HOTSPOT_GEOJSON_URL', '1') == '1'
+
+def geometry_name(spec):
+    # the geometry's URL segment; every partition of a city shares it
+    return spec['city'].lower().replace(' ', '-')
+
+def map_geojson(spec):
+    geometry = get_geometry(spec['geojson_dir'])
+    if GEOJSON_URL:
+        # plotly.js fetches a string geojson itself; the name is content-hashed, so the
+        # browser downloads it once and reuses it for every date
+        return f'/geometry/{geometry_name(spec)}/{geometry.digest}.geojson'
+    return geometry.geojson
+
+def serve_geometry(name, digest):
+    # seasons of a city can each have their own geojson_dir: any of them with this digest
+    directories = {spec['geojson_dir'] for spec in PARTITIONS if geometry_name(spec) == name}
+    geometry = next((geometry for geometry in map(get_geometry, sorted(directories)) if geometry.digest == digest), None)
+    if geometry is None:
+        abort(404)
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        response = Response(geometry.gzipped, mimetype='application/geo+json')
+        response.headers['Content-Encoding'] = 'gzip'
     else:
+        response = Response(geometry.body, mimetype='application/geo+json')
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+# seconds between checks for changed source files; 0 never reloads
+DATA_CHECK_INTERVAL = float(os.environ.get('HOTSPOT_DATA_CHECK_INTERVAL', 60))
+FIGURE_CACHE_SIZE = int(os.environ.get('HOTSPOT_FIGURE_CACHE_SIZE', 64))
+
+def load_partition(spec):
+    # one partition's tables plus everything derived from them; evicted together
+    data = load_datasets(spec)
+    data['spec'] = spec
+    data['weeks'] = WeekIndex(data)
+    data['figures'] = FigureCache(lambda key: map_figure_json(data, key), maxsize=FIGURE_CACHE_SIZE)
+    get_geometry(spec['geojson_dir'])
+    return data
+
+partitions = PartitionStore(PARTITIONS, load_partition, check_interval=DATA_CHECK_INTERVAL)
+
+def get_app2_data(city=DEFAULT_PARTITION[0], disease=DEFAULT_PARTITION[1], season=None):
+    # The partition update_map reads for a selection, None when we have no data for it.
+    # Loaded on first use (the default one by run_app_2's warm-up) and reloaded, with a new
+    # 'version', when its source files change.
+    key = partitions.find(city, disease, season)
+    if key is None:
         return None
+    return partitions.get(key)
+
+MAPBOX_STYLE = "carto-positron"
+
+def build_map_figure(filtered_data, spec=CHICAGO_FLU_2024, mapbox_style=MAPBOX_STYLE):
+    import plotly.express as px
+
+    fig = px.choropleth_mapbox(filtered_data, 
+                            geojson=map_geojson(spec), 
+                            locations='ZIP_Code', 
+                            featureidkey="properties.postal-code",  # Match the key in your GeoJSON
+                            color='ILI',
+                            color_continuous_scale="Viridis",
+                            range_color=(1, 10),  # Normalized range
+                            mapbox_style=mapbox_style,
+                            zoom=spec['zoom'], center=spec['center'],  # Center on the city
+                            opacity=0.5
+                            )
+    
+    # Update layout to remove margins
+    fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
+    return fig
+
+def map_figure_json(data, key):
+    # timed as update_map stages, including the builds warm_up does ahead of any request
+    week_number, mapbox_style = key
+    with timed(STAGE_SECONDS, 'update_map', 'figure'):
+        fig = build_map_figure(data['weeks'].risk(week_number), data['spec'], mapbox_style)
+    with timed(STAGE_SECONDS, 'update_map', 'serialize'):
+        figure = json.loads(fig.to_json())
+    # an embedded geometry is shared by every cached figure instead of copied into each
+    if not GEOJSON_URL:
+        for trace in figure['data']:
+            trace['geojson'] = get_geometry(data['spec']['geojson_dir']).geojson
+    return figure
+
+def empty_map_figure():
+    # for selections we have no partition for
+    return {'data': [],
+            'layout': {'mapbox': {'style': MAPBOX_STYLE, 'center': {'lat': 39.5, 'lon': -98.35}, 'zoom': 3},
+                       'margin': {'r': 0, 't': 0, 'l': 0, 'b': 0}}}
+
+# HOTSPOT_MAP_UPDATE: 'patch' (default) sends only the trace arrays when the date changes and
+# leaves layout, style, color scale and geometry on the client; 'figure' sends the whole figure
+MAP_UPDATE = os.environ.get('HOTSPOT_MAP_UPDATE', 'patch')
+
+def map_patch(figure):
+    # the cached figure's per-week arrays as a dash.Patch against the figure already shown
+    patch = dash.Patch()
+    for i, trace in enumerate(figure['data']):
+        patch['data'][i]['locations'] = trace['locations']
+        patch['data'][i]['z'] = trace['z']
+    return patch
+
+EMPTY_KPI_TABLES = {'ili': {}, 'cases': {}, 'top_age': {}}
+
+def kpi_tables(data):
+    # Everything the four lookup boxes read, keyed by MMWR week (as strings, for JSON)
+    weeks = data['weeks']
+    ili = {}
+    for week in weeks.risk_ranges:
+        value = weeks.zip_ili(week, data['spec']['highlight_zip'])
+        if value is not None:
+            ili[str(week)] = value
+    return {
+        'ili': ili,
+        'cases': {str(week): cases for week, cases in weeks.cases.items()},
+        'top_age': {str(week): age for week, age in weeks.top_age.items()},
+    }
+
+def get_kpi_tables(data):
+    # built once per loaded partition
+    if data is None:
+        return EMPTY_KPI_TABLES
+    if 'kpi' not in data:
+        data['kpi'] = kpi_tables(data)
+    return data['kpi']
+
+# The picked date's year, only when it changes, so the kpi-store refetch runs once per season
+SEASON_JS = """
+function(date, season) {
+    var year = date ? parseInt(date.slice(0, 4), 10) : null;
+    return year === season ? window.dash_clientside.no_update : year;
+}
+"""
+
+# Fills the boxes from the kpi-store tables in the browser, the same rules update_map used:
+# nothing past week 39, cases and pct change up to week 37, the week's top age group up to week 38.
+KPI_BOXES_JS = """
+function(date, tables) {
+    var noUpdate = window.dash_clientside.no_update;
+    if (!date || !tables) {
+        return [noUpdate, noUpdate, noUpdate, noUpdate];
+    }
+    var parts = date.slice(0, 10).split('-');
+    var day = new Date(Date.UTC(+parts[0], +parts[1] - 1, +parts[2]));
+    // ISO week: the week that holds this week's Thursday
+    day.setUTCDate(day.getUTCDate() + 4 - (day.getUTCDay() || 7));
+    var yearStart = Date.UTC(day.getUTCFullYear(), 0, 1);
+    var week = Math.ceil(((day - yearStart) / 86400000 + 1) / 7);
+
+    if (week >= 40) {
+        return ['No Data', 'No Data', 'No Data', 'No Data'];
+    }
+    var ili = tables.ili[week] !== undefined ? tables.ili[week].toFixed(2) : 'No Data';
+    var percent = 'N/A', cases = 'N/A', age = 'N/A';
+    if (week < 38) {
+        var current = tables.cases[week], previous = tables.cases[week - 1];
+        if (current === undefined) {
+            cases = 'No Data';
+            percent = 'No Data';
+        } else {
+            cases = String(current);
+            if (previous !== undefined) {
+                var change = previous !== 0 ? (current - previous) / previous * 100 : 0;
+                percent = change.toFixed(2) + '%';
+            }
+        }
+    } else {
+        cases = 'No Data';
+    }
+    age = week < 39 && tables.top_age[week] !== undefined ? tables.top_age[week] : 'No Data';
+    return [ili, percent, cases, age];
+}
+"""
+
+def warm_up(report_phases=False):
+    # app.py reports the startup phases once the app is up; a warm-up thread finishes after
+    # that and reports them itself
+    with phase('data_load'):
+        data = get_app2_data(*DEFAULT_PARTITION)
+    with phase('plotly_import'):
+        import plotly.express
+    # the first figure builds plotly's validators and templates; do it here, not in a request
+    with phase('first_figure'):
+        build_map_figure(data['df1'].head(0), data['spec']).to_json()
+    # there are only ~40 distinct weeks, build them all up front unless HOTSPOT_FIGURE_WARM=0
+    if os.environ.get('HOTSPOT_FIGURE_WARM', '1') == '1':
+        with phase('figure_warm'):
+            weeks = sorted(data['df1']['MMWR_Week'].unique().tolist())
+            data['figures'].warm([(week, MAPBOX_STYLE) for week in weeks], data['version'])
+    if report_phases:
+        report()
+
+def get_semantics(data, stats=None):
+    # `data` is either the loaded export or a path to it; a path is streamed
+    # instead of loaded. Segments we can't read are skipped and counted in `stats`.
+    # Returns a SEMANTIC_DTYPE array (see timeline_columns).
+    if stats is None:
+        stats = collections.Counter()
+    if isinstance(data, dict):
+        records = (convert('semantic', i, stats) for i in data['semanticSegments'])
+        return semantics_array(record for record in records if record is not None)
+    return semantics_array(iter_semantics(data, stats))
+
+def get_raw(data, stats=None):
+    # Returns a RAW_DTYPE array (see timeline_columns).
+    if stats is None:
+        stats = collections.Counter()
+    if isinstance(data, dict):
+        records = (convert('raw', i, stats) for i in data['rawSignals'])
+        return raw_array(record for record in records if record is not None)
+    return raw_array(iter_raw(data, stats))
+
+def get_latest(raw, semantics, start_time, end_time, closed='left', raw_index=None, semantics_index=None):
+    # raw by 'timestamp', semantics by 'start'. closed='left' keeps [start_time, end_time);
+    # pass prebuilt TimeIndex objects to skip re-sorting when slicing many windows
+    return get_windows(raw, semantics, [(start_time, end_time)], closed, raw_index, semantics_index)[0]
+
+def get_windows(raw, semantics, windows, closed='left', raw_index=None, semantics_index=None):
+    # slice many (start_time, end_time) windows with two searchsorted calls;
+    # sorted inputs come back as views, not copies
+    if raw_index is None:
+        raw_index = TimeIndex(raw['timestamp'])
+    if semantics_index is None:
+        semantics_index = TimeIndex(semantics['start'])
+    starts = [window[0] for window in windows]
+    ends = [window[1] for window in windows]
+    raw_lo, raw_hi = raw_index.bounds_many(starts, ends, closed)
+    semantics_lo, semantics_hi = semantics_index.bounds_many(starts, ends, closed)
+
+    results = []
+    for i in range(len(windows)):
+        results.append((raw_index.take(raw, raw_lo[i], raw_hi[i]),
+                        semantics_index.take(semantics, semantics_lo[i], semantics_hi[i])))
+    return results
+
+def get_activity_location(updated_raw, updated_semantics, closed='both', overlap='latest'):
+    # (updated_raw index, updated_semantics index) rows for every raw signal inside a segment.
+    # A signal on the boundary of two adjacent segments goes to the one starting there;
+    # see interval_join for the other closed/overlap modes.
+    raw_idx, semantic_idx = interval_join(updated_raw['timestamp'], updated_semantics['start'],
+                                          updated_semantics['end'], closed, overlap)
+    return np.column_stack([raw_idx, semantic_idx])
+
+
+def travel_signals(raw, semantics):
+    # signals without a position of their own inside a travel segment, for each joined pair
+    return (raw['kind'] != RawKind.POSITION) & (semantics['kind'] == SemanticKind.TRAVEL)
+
+def get_zip_code_activity(updated_raw, updated_semantics, location_activity, fallback=True, cache=None, geocoder=None,
+                          travel_parity=0, directory=geojson_dir):
+    location_activity = np.asarray(location_activity, dtype='int64').reshape(-1, 2)
+    raw = updated_raw[location_activity[:, 0]]
+    semantics = updated_semantics[location_activity[:, 1]]
+
+    # position scans carry their own location, everything else takes it from its segment:
+    # the place of a stay, or alternately the start and end of a travel segment. The
+    # alternation carries on from `travel_parity`, the count of travel signals before these, mod 2
+    lats = semantics['lat'].copy()
+    lons = semantics['lon'].copy()
+    travel = travel_signals(raw, semantics)
+    use_end = travel & ((np.cumsum(travel) + travel_parity) % 2 == 0)
+    lats[use_end] = semantics['end_lat'][use_end]
+    lons[use_end] = semantics['end_lon'][use_end]
+    position = raw['kind'] == RawKind.POSITION
+    lats[position] = raw['lat'][position]
+    lons[position] = raw['lon'][position]
+
+    types = raw['activity'].copy()
+    types[position] = activity_code('positionscan')
+    types[raw['kind'] == RawKind.WIFI] = activity_code('wifiscan')
+
+    # resolve all positions in one batch instead of one lookup per record
+    zip_codes = get_zip_codes(lats, lons, fallback, cache, geocoder, directory)
+    zip_activity = np.empty(len(raw), dtype=ZIP_ACTIVITY_DTYPE)
+    zip_activity['timestamp'] = raw['timestamp']
+    zip_activity['tz_offset'] = raw['tz_offset']
+    zip_activity['type'] = types
+    zip_activity['zipcode'] = [zip_code or '' for zip_code in zip_codes]
+    return zip_activity
 
-# run this when you need new data
-# with open('Timeline (1).json', 'r') as file:
-#     data = json.load(file)
-# semantics = get_semantics(data)
-# raw = get_raw(data)
-# updated_raw, updated_semantics = get_latest(raw, semantics, '2024-09-18T00:00:00.000-05:00', '2024-09-25T00:00:00.000-05:00')
-# location_activity = get_activity_location(updated_raw, updated_semantics)
-# zip_activity = get_zip_code_activity(updated_raw, updated_semantics, location_activity)
-# with open('data_18_24.json', 'w') as json_file:
-#     json.dump(zip_activity, json_file, indent=4)
-def run_app_2(server):
-    df = pd.read_csv('Influenza_Surveillance_Weekly.csv')
-    df['WEEK_START'] = pd.to_datetime(df['WEEK_START'])
-    df['WEEK_END'] = pd.to_datetime(df['WEEK_END'])
-    df = df[df['WEEK_START'].dt.year >= 2024]
-    df.sort_values(by='WEEK_START', ascending = False, inplace = True)
-    df.drop(['MMWR_WEEK'], axis = 1, inplace = True)
-    df['week'] = np.arange(37, 1, -1)
-
-    df1 = pd.read_csv('risk_level.csv')
-    df1 = df1[(df1['ZIP_Code'] > 60600) & (df1['ZIP_Code'] < 60666)]
-    df1 = df1[pd.to_datetime(df1['Week_Start']).dt.year >= 2024]
-    df1['Week_Start'] = pd.to_datetime(df1['Week_Start'])
-    df1['Week_End'] = pd.to_datetime(df1['Week_End'])
-    df1.rename(columns={'ILI_Activity_Level':'ILI'}, inplace = True) # ili - influenza like illness
-    df1.sort_values(by='Week_Start', inplace = True)
-
-    age_df = pd.read_csv('FluSurveillance_Custom_Download_Data.csv',skiprows = 2)
-    age_df.rename(columns=str.lower, inplace=True)
-    age_df = age_df[['age category','mmwr-year','mmwr-week','cumulative rate','weekly rate']]
-    age_df.replace([np.inf, -np.inf], np.nan, inplace=True)
-    age_df.dropna(inplace = True)
-    age_df['mmwr-year'] = age_df['mmwr-year'].astype('int64')
-    age_df['mmwr-week'] = age_df['mmwr-week'].astype('int64')
-    age_df = age_df[age_df['mmwr-year'] == 2024]
-    age_df = age_df[~(age_df['age category'] == 'Overall')]
-
-    population = pd.read_csv('Chicago_Population_Counts.csv')
-    population = population[population['Year'] == 2021]
-    population = population[['Geography','Population - Total']]
-    total_population = population.iloc[0]
-    population.drop(index = 175, axis = 0, inplace = True)
-    population['Geography'] = population['Geography'].astype('int64')
-    pop_dict = population.set_index('Geography')['Population - Total'].to_dict()
-
-    with open('data_18_24.json', 'r') as file:
-        json_data = json.load(file)
-    df2 = pd.DataFrame(json_data)
-    df2['timestamp'] = pd.to_datetime(df2['timestamp'])
-    df2['type'] = df2['type'].astype('str')
-    df2['zipcode'] = df2['zipcode'].astype('int64')
-    df2 = df2[~((df2['timestamp'].duplicated()) & ((df2['type'] == 'positionscan') | (df2['type'] == 'wifiscan')))]
-    df2['week'] = df2['timestamp'].dt.isocalendar().week
-    df2 = df2[df2['zipcode'] <= 60666]
-    df2.dropna(inplace = True)
-    df2['population'] = df2['zipcode'].apply(lambda x : pop_dict[x])
-    temp_df = df[['week','LAB_FLU_TESTED']]
-    temp_df.loc[:,'week'] = temp_df['week'] + 2
-    temp_df_dict = temp_df.set_index('week')['LAB_FLU_TESTED'].to_dict()
-    df2['cases'] = df2['week'].apply(lambda x : temp_df_dict[x])
-    df2.reset_index(drop = True, inplace = True)
-    list_df = list(df2.values)
-
-    i = 0
-    while i < len(list_df) - 1:
-        if list_df[i+1][1] == list_df[i][1] and list_df[i+1][2] == list_df[i][2]:
-            list_df.pop(i+1)
-        else:
-            i += 1
-
-    estimate = []
-    estimate_daterange = {}
-    factors = {'UNKNOWN':1.0,'positionscan':2.0,'wifiscan':2.0,'STILL':2.0,'WALKING':1.0,'ON_FOOT':1.0,'RUNNING':0.5,'ON_BICYCLE':0.5, 'IN_ROAD_VECHICLE':0.5,
-                'IN_RAIL_VEHICLE':5.0,'IN_VEHICLE':2.0, 'TILTING':1.0,'EXITING_VEHICLE':1.0}
-    for i in range(len(list_df)-1):
-        if list_df[i][0].day == list_df[i+1][0].day:
-            temp = ((list_df[i+1][0] - list_df[i][0]).total_seconds() / 60, factors[list_df[i][1]], list_df[i][5]/list_df[i][4])
-            if sum(temp) > 240:
+def get_zip_code(lat, lon, fallback=True, cache=None, geocoder=None, directory=geojson_dir):
+    return get_zip_codes([lat], [lon], fallback, cache, geocoder, directory)[0]
+
+def get_zip_codes(lats, lons, fallback=True, cache=None, geocoder=None, directory=geojson_dir):
+    # local polygon lookup first (the ZIP polygons in `directory`, a partition's geojson_dir),
+    # then the on-disk cache, OpenCage only for what is left
+    from zip_lookup import get_resolver
+
+    lats = np.asarray(lats, dtype='float64')
+    lons = np.asarray(lons, dtype='float64')
+    zip_codes = get_resolver(directory).lookup_many(lats, lons)
+    ZIP_LOOKUPS.inc('polygon', amount=int(np.count_nonzero(zip_codes != None)))
+    if fallback:
+        if cache is None:
+            cache = get_geocode_cache()
+        resolved = {}
+        pending = {}
+        for i in np.flatnonzero(zip_codes == None):
+            key = cache.key(lats[i], lons[i])
+            if key in resolved or key in pending:
                 continue
-            estimate.append(temp)
-        else:
-            temp_date_holder = datetime.strptime(str(list_df[i][0]), '%Y-%m-%d %H:%M:%S%z').strftime('%Y-%m-%d')
-            estimate_daterange[temp_date_holder] = i
-    
-    app2 = dash.Dash("app2", external_stylesheets=[dbc.themes.BOOTSTRAP], server=server, url_base_pathname='/app2/')
-    app2.layout = html.Div([
+            hit, zip_code = cache.get(lats[i], lons[i])
+            if hit:
+                resolved[key] = zip_code
+            else:
+                pending[key] = (lats[i], lons[i])
+
+        if pending:
+            # the misses go out together through the rate limited async client
+            from async_geocoder import AsyncGeocoder, reverse_geocode_many
+
+            if geocoder is None:
+                geocoder = AsyncGeocoder(concurrency=int(os.environ.get('HOTSPOT_GEOCODER_CONCURRENCY', 8)),
+                                         rate=float(os.environ.get('HOTSPOT_GEOCODER_RATE', 1.0)))
+            coordinates = list(pending.values())
+            requests, retries, errors = geocoder.requests, geocoder.retries, geocoder.errors
+            with timed(GEOCODER_SECONDS):
+                fetched = reverse_geocode_many(coordinates, geocoder)
+            GEOCODER_REQUESTS.inc(amount=geocoder.requests - requests)
+            GEOCODER_RETRIES.inc(amount=geocoder.retries - retries)
+            GEOCODER_ERRORS.inc(amount=geocoder.errors - errors)
+            resolved.update(zip(pending.keys(), fetched))
+            cache.put_many([(lat, lon, zip_code) for (lat, lon), zip_code in zip(coordinates, fetched)
+                            if (float(lat), float(lon)) not in geocoder.failed])
+
+        from_cache = from_geocoder = 0
+        for i in np.flatnonzero(zip_codes == None):
+            key = cache.key(lats[i], lons[i])
+            zip_codes[i] = resolved[key]
+            if key in pending:
+                from_geocoder += 1
+            else:
+                from_cache += 1
+        ZIP_LOOKUPS.inc('cache', amount=from_cache)
+        ZIP_LOOKUPS.inc('geocoder', amount=from_geocoder)
+    return list(zip_codes)
+
+# run this when you need new data:
+#   python prepare_data.py exports/ --out zip_activity_users --start 2024-09-18T00:00:00.000-05:00 --end 2024-09-25T00:00:00.000-05:00
+# or append only signals newer than the last run:
+#   python ingest.py 'Timeline (1).json' --export-json data_18_24.json
+def build_layout():
+    return html.Div([
         # Date Picker for selecting the date range
         html.Div([
             html.Div(
@@ -352,7 +458,10 @@ def run_app_2(server):
         html.Div([
             # Div to wrap the map and limit its width
             html.Div([
-                dcc.Graph(id='choropleth-map')
+                dcc.Graph(id='choropleth-map'),
+                # week-keyed tables behind the ILI, pct change, cases and age boxes, see kpi_tables
+                dcc.Store(id='kpi-store'),
+                dcc.Store(id='season'),
             ], style={
                 'width': '60%',  # Increased map width to 60%
                 'height': 'calc(100vh - 100px)',  # Adjust height calculation
@@ -543,6 +652,31 @@ def run_app_2(server):
                             'backgroundColor': '#20B2AA',  # Set the background color to blue
                             'margin': '10px',  # Reduced margin for spacing
                         }),
+                        # optional date range for the probability; the map's date is used when empty
+                        dcc.DatePickerRange(
+                            id='exposure-range',
+                            clearable=True,
+                            start_date_placeholder_text='From',
+                            end_date_placeholder_text='To',
+                        ),
+                        # your own Timeline export instead of the sample one, scored in the background
+                        dcc.Upload(
+                            id='timeline-upload',
+                            children=html.Div('Drop or select your Timeline export'),
+                            multiple=False,
+                            style={
+                                'width': '250px',
+                                'padding': '10px',
+                                'marginTop': '10px',
+                                'borderWidth': '1px',
+                                'borderStyle': 'dashed',
+                                'borderRadius': '10px',
+                                'textAlign': 'center',
+                            },
+                        ),
+                        html.Progress(id='upload-progress', value='0', max='4', style={'width': '250px'}),
+                        html.Div(id='upload-status'),
+                        dcc.Store(id='user-exposure', storage_type='session'),
                     ], style={
                         'display': 'flex', 
                         'flexDirection': 'column', 
@@ -646,92 +780,150 @@ def run_app_2(server):
         'marginTop':'2%',
     })
 
+def run_app_2(server):
+    # Data is loaded off the request path so /app1/ and health checks are served right away.
+    # HOTSPOT_APP2_WARMUP: 'thread' (default) loads in the background, 'eager' before returning,
+    # 'lazy' on the first update_map call.
+    warmup = os.environ.get('HOTSPOT_APP2_WARMUP', 'thread')
+    if warmup == 'eager':
+        warm_up()
+    elif warmup == 'thread':
+        threading.Thread(target=warm_up, args=(True,), name='app2-warmup', daemon=True).start()
+
+    server.add_url_rule('/geometry/<name>/<digest>.geojson', 'geometry', serve_geometry)
+
+    with phase('app2_layout'):
+        app2 = dash.Dash("app2", external_stylesheets=[dbc.themes.BOOTSTRAP], server=server, url_base_pathname='/app2/',
+                         background_callback_manager=get_background_manager())
+        app2.layout = build_layout()
+
+    app2.clientside_callback(
+        SEASON_JS,
+        Output('season', 'data'),
+        Input('date-picker', 'date'),
+        State('season', 'data'),
+    )
 
     @app2.callback(
-        [Output('choropleth-map', 'figure'),
-        Output('ili-value-60616', 'children'),
+        Output('kpi-store', 'data'),
+        [Input('city-dropdown', 'value'),
+        Input('disease-dropdown', 'value'),
+        Input('season', 'data'),]
+    )
+    def load_kpi_tables(city, disease, season):
+        # once per partition the page shows; the boxes are then computed client-side
+        with timed(STAGE_SECONDS, 'load_kpi_tables', 'boxes'):
+            tables = get_kpi_tables(get_app2_data(city, disease, season))
+        callback_returned('load_kpi_tables')
+        return tables
+
+    app2.clientside_callback(
+        KPI_BOXES_JS,
+        [Output('ili-value-60616', 'children'),
         Output('pct_change','children'),
         Output('cases_weekly','children'),
-        Output('targetted_age','children'),
-        Output('probability','children'),],
+        Output('targetted_age','children'),],
+        [Input('date-picker', 'date'),
+        Input('kpi-store', 'data'),]
+    )
+
+    @app2.callback(
+        Output('choropleth-map', 'figure'),
         [
             Input('date-picker', 'date'),
+            Input('city-dropdown', 'value'),
+            Input('disease-dropdown', 'value'),
         ]
     )
 
-    def update_map(date):
+    def update_map(date, city, disease):
         # populate the graph
-        week_number = pd.to_datetime(date).isocalendar().week
-        filtered_data = df1[df1['MMWR_Week'] == week_number]
-        fig = px.choropleth_mapbox(filtered_data, 
-                                geojson=all_geojson, 
-                                locations='ZIP_Code', 
-                                featureidkey="properties.postal-code",  # Match the key in your GeoJSON
-                                color='ILI',
-                                color_continuous_scale="Viridis",
-                                range_color=(1, 10),  # Normalized range
-                                mapbox_style="carto-positron",
-                                zoom=9, center={"lat": 41.85, "lon": -87.6298},  # Center on Chicago
-                                opacity=0.5
-                                )
-        
-        # Update layout to remove margins
-        fig.update_layout(margin={"r": 0, "t": 0, "l": 0, "b": 0})
-
-        # populate the boxes
-        if week_number < 40:
-            # initialize no values
-            ili_display, cases_display, percent_display, age_display, probability_display = 'N/A', 'N/A','N/A','N/A','N/A'
-            # populate the ili box
-            zip_60616_data = filtered_data[filtered_data['ZIP_Code'] == 60616]
-            if not zip_60616_data.empty:
-                ili_value_60616 = zip_60616_data['ILI'].iloc[0]
-                ili_display = f"{ili_value_60616:.2f}"
-            else:
-                ili_display = "No Data"
-
-            # populate cases weekly box and pct change box
-            if week_number < 38:
-                cases_weekly = df[df['week'] == week_number]['LAB_FLU_TESTED'].values[0]
-                previous_week_data = df[df['week'] == week_number - 1]
-                previous_week_cases = previous_week_data['LAB_FLU_TESTED'].values[0]
-                percent_change = ((cases_weekly - previous_week_cases) / previous_week_cases) * 100 if previous_week_cases != 0 else 0
-                percent_display = f"{percent_change:.2f}%"
-                cases_display = f"{cases_weekly}"  
-            else:
-                cases_display = "No Data"
-                precent_display = "No Data"
-
-            # populate the targetted age box
-            if week_number < 39:
-                targetted_week = age_df[age_df['mmwr-week'] == week_number]
-                targetted_age = age_df.loc[age_df['weekly rate'].idxmax(), 'age category']
-                age_display = f"{targetted_age}"
-            else:
-                age_display = "No Data"
+        # stages in hotspot_stage_seconds: filter, figure_cache (figure and serialize on a miss),
+        # patch and response
+        with timed(STAGE_SECONDS, 'update_map', 'filter'):
+            day = date[:10]  # the initial value carries a time
+            data = get_app2_data(city, disease, day[:4])
+            week_number = datetime.strptime(day, '%Y-%m-%d').isocalendar().week
+        if data is None:
+            callback_returned('update_map')
+            return empty_map_figure()
+        with timed(STAGE_SECONDS, 'update_map', 'figure_cache'):
+            fig = data['figures'].get((int(week_number), MAPBOX_STYLE), data['version'])
+        # only a date change can be patched: the initial call has no figure on the client yet,
+        # and another city or disease brings its own geometry and view
+        if MAP_UPDATE == 'patch' and dash.ctx.triggered_id == 'date-picker':
+            with timed(STAGE_SECONDS, 'update_map', 'patch'):
+                fig = map_patch(fig)
+        # the lookup boxes are filled client-side from kpi-store (KPI_BOXES_JS)
+        callback_returned('update_map')
+        return fig
 
-            # popublate the probability box
-            if date not in pd.to_datetime(list(estimate_daterange.keys())):
-                probability_display = "No Data"
-            else:
-                end_index = estimate_daterange[date] + 1
-                date_obj = datetime.strptime(date, '%Y-%m-%d')
-                new_date = date_obj - timedelta(days=1)
-                new_date_str = new_date.strftime('%Y-%m-%d')
-                start_index = 0
-                if new_date_str in estimate_daterange.keys():
-                    start_index = estimate_daterange[new_date_str] + 1
-                filtered_estimate = estimate[start_index : end_index]
-                probability = np.sum(np.prod(filtered_estimate, axis = 1))/600 * 100
-                if probability > 99.99:
-                    probability = 99.99
-                probability_display = f"{probability:.2f}%"
-
-            return fig, ili_display, percent_display, cases_display, age_display, probability_display
+    @app2.callback(
+        [Output('user-exposure', 'data'),
+        Output('upload-status', 'children'),],
+        [Input('timeline-upload', 'contents'),],
+        [State('timeline-upload', 'filename'),
+        State('city-dropdown', 'value'),
+        State('disease-dropdown', 'value'),
+        State('season', 'data'),],
+        background=True,
+        progress=[Output('upload-progress', 'value'),
+                  Output('upload-progress', 'title'),],
+        running=[(Output('timeline-upload', 'disabled'), True, False),],
+        prevent_initial_call=True,
+    )
+
+    def score_timeline(set_progress, contents, filename, city, disease, season):
+        # runs in a background process; results are kept per upload and partition, see user_jobs.py
+        data = get_app2_data(city, disease, season)
+        if data is None:
+            return dash.no_update, f"No {disease} data for {city} to score {filename} against"
+        partition = partition_name(data['spec'])
+        digest = upload_digest(contents, partition)
+        if load_exposure(digest) is None:
+
+            def progress(step, text):
+                set_progress((str(step), text))
+
+            try:
+                exposure = score_export(decode_upload(contents), data['spec'], data['pop_dict'],
+                                        exposure_cases(data['df']), progress)
+            except (ValueError, KeyError, TypeError) as e:
+                return dash.no_update, f"Couldn't read {filename}: {e}"
+            save_exposure(digest, exposure)
+        return {'digest': digest, 'filename': filename, 'partition': partition}, f"Using {filename}"
+
+    @app2.callback(
+        Output('probability','children'),
+        [
+            Input('date-picker', 'date'),
+            Input('exposure-range', 'start_date'),
+            Input('exposure-range', 'end_date'),
+            Input('user-exposure', 'data'),
+            Input('city-dropdown', 'value'),
+            Input('disease-dropdown', 'value'),
+        ]
+    )
 
+    def update_probability(date, start_date, end_date, upload, city, disease):
+        # the picked range when both ends are set, otherwise the map's date
+        if start_date and end_date:
+            start, end = start_date, end_date
         else:
-            # If no data for the selected range
-            return fig, "No Data", "No Data", "No Data", "No Data", "No Data"
+            start = end = date
+        data = get_app2_data(city, disease, date[:4])
+        if data is None:
+            return "No Data"
+        # the export uploaded for this partition once it's scored, the sample one until then
+        exposure = None
+        if upload and upload.get('partition') == partition_name(data['spec']):
+            exposure = load_exposure(upload['digest'])
+        if exposure is None:
+            exposure = data['exposure']
+        probability = exposure.probability(start, end) if exposure is not None else None
+        if probability is None:
+            return "No Data"
+        return f"{probability:.2f}%"
 
     warnings.filterwarnings("ignore")
     return app2
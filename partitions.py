@@ -0,0 +1,100 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from datasets import CHICAGO_FLU_2024, FRAMES, partition_name, sources_fingerprint
+
+
+# Every city x disease x season the dashboard knows about. Only Chicago flu ships with the repo;
+# HOTSPOT_PARTITIONS names a JSON file with a list of further specs (same keys as
+# CHICAGO_FLU_2024, missing ones taken from it). Nothing is read until a partition is selected.
+PARTITIONS = [CHICAGO_FLU_2024]
+if os.environ.get('HOTSPOT_PARTITIONS'):
+    with open(os.environ['HOTSPOT_PARTITIONS']) as f:
+        PARTITIONS = PARTITIONS + [dict(CHICAGO_FLU_2024, **spec) for spec in json.load(f)]
+
+DEFAULT_PARTITION = ('Chicago', 'flu', 2024)
+# loaded partitions are evicted, least recently used first, past this many MB
+MEMORY_BUDGET = float(os.environ.get('HOTSPOT_PARTITION_BUDGET_MB', 256)) * 1024 * 1024
+
+
+def partition_key(spec):
+    return (spec['city'], spec['disease'], int(spec['season']))
+
+
+def partition_nbytes(data):
+    # rough resident size: the frames and the exposure prefix sums
+    nbytes = sum(int(data[name].memory_usage(deep=True).sum()) for name in FRAMES)
+    if data.get('exposure') is not None:
+        nbytes += data['exposure'].sums.nbytes + data['exposure'].counts.nbytes
+    return nbytes
+
+
+class PartitionStore:
+    # Loads partitions on first use with `loader(spec)` and keeps the most recently used ones
+    # within `budget` bytes. A loaded partition is reloaded when its sources change
+    # (checked at most every `check_interval` seconds).
+    def __init__(self, specs, loader, budget=MEMORY_BUDGET, check_interval=60):
+        self.specs = {partition_key(spec): spec for spec in specs}
+        self.loader = loader
+        self.budget = budget
+        self.check_interval = check_interval
+        self.loads = 0
+        self.evictions = 0
+        self._loaded = OrderedDict()  # key -> [data, nbytes, last checked]
+        self._lock = threading.Lock()
+        self._load_locks = {key: threading.Lock() for key in self.specs}
+
+    def find(self, city, disease, season=None):
+        # the key for a selection: that season if we have it, otherwise the latest one
+        seasons = sorted(key[2] for key in self.specs if key[:2] == (city, disease))
+        if not seasons:
+            return None
+        if season is not None and int(season) in seasons:
+            return (city, disease, int(season))
+        return (city, disease, seasons[-1])
+
+    def get(self, key):
+        # the partition's data, or None for partitions that don't exist
+        if key not in self.specs:
+            return None
+        with self._lock:
+            entry = self._loaded.get(key)
+            if entry is not None:
+                self._loaded.move_to_end(key)
+        if entry is not None and not self._stale(key, entry):
+            return entry[0]
+
+        with self._load_locks[key]:
+            with self._lock:
+                entry = self._loaded.get(key)
+            if entry is not None and not self._stale(key, entry):
+                return entry[0]
+            data = self.loader(self.specs[key])
+            with self._lock:
+                self._loaded[key] = [data, partition_nbytes(data), time.monotonic()]
+                self._loaded.move_to_end(key)
+                self.loads += 1
+                self._evict(keep=key)
+        return data
+
+    def _stale(self, key, entry):
+        if not self.check_interval or time.monotonic() - entry[2] <= self.check_interval:
+            return False
+        entry[2] = time.monotonic()
+        return sources_fingerprint(self.specs[key]) != entry[0]['version']
+
+    def _evict(self, keep):
+        total = sum(entry[1] for entry in self._loaded.values())
+        for key in list(self._loaded):
+            if total <= self.budget:
+                break
+            if key != keep:
+                total -= self._loaded.pop(key)[1]
+                self.evictions += 1
+
+    def loaded(self):
+        with self._lock:
+            return {partition_name(self.specs[key]): entry[1] for key, entry in self._loaded.items()}
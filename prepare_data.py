@@ -0,0 +1,117 @@
+import argparse
+import collections
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from page2 import get_raw, get_semantics, get_latest, get_activity_location, get_zip_code_activity
+from timeline_columns import zip_activity_records
+
+
+class ProgressReporter:
+    # prints at most one progress line every `interval` seconds
+    def __init__(self, total, interval=2.0, stream=sys.stderr):
+        self.total = total
+        self.interval = interval
+        self.stream = stream
+        self.done = 0
+        self.failed = 0
+        self.records = 0
+        self.started = time.perf_counter()
+        self.last_report = 0.0
+
+    def update(self, records=0, failed=False):
+        self.done += 1
+        self.records += records
+        self.failed += failed
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval or self.done == self.total:
+            self.last_report = now
+            elapsed = now - self.started
+            print(f'[{self.done}/{self.total}] {self.records} records, {self.records / elapsed:.0f} records/s, '
+                  f'{self.failed} failed', file=self.stream, flush=True)
+
+
+def process_export(path, out_dir, start_time=None, end_time=None, fallback=True):
+    # the whole pipeline for one user's export; output is <out_dir>/<export name>.json
+    started = time.perf_counter()
+    stats = collections.Counter()
+    semantics = get_semantics(path, stats)
+    raw = get_raw(path, stats)
+    if start_time is not None or end_time is not None:
+        raw, semantics = get_latest(raw, semantics, start_time or 0, end_time or 2 ** 62)
+    location_activity = get_activity_location(raw, semantics)
+    zip_activity = get_zip_code_activity(raw, semantics, location_activity, fallback)
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    out_path = os.path.join(out_dir, name + '.json')
+    with open(out_path, 'w') as json_file:
+        json.dump(zip_activity_records(zip_activity), json_file, indent=4)
+    return {'export': path,
+            'output': out_path,
+            'signals': len(raw),
+            'records': len(zip_activity),
+            'seconds': time.perf_counter() - started,
+            'skipped': stats['raw_unknown'] + stats['semantic_unknown']}
+
+
+def _init_worker(geocoder_rate):
+    # the provider quota is shared by every worker
+    os.environ['HOTSPOT_GEOCODER_RATE'] = str(geocoder_rate)
+
+
+def run(exports, out_dir, workers=None, start_time=None, end_time=None, fallback=True, interval=2.0):
+    os.makedirs(out_dir, exist_ok=True)
+    workers = workers or os.cpu_count()
+    geocoder_rate = float(os.environ.get('HOTSPOT_GEOCODER_RATE', 1.0)) / workers
+    progress = ProgressReporter(len(exports), interval)
+    results = []
+    failures = []
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(geocoder_rate,)) as pool:
+        futures = {pool.submit(process_export, path, out_dir, start_time, end_time, fallback): path for path in exports}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                failures.append({'export': futures[future], 'error': f'{type(e).__name__}: {e}'})
+                progress.update(failed=True)
+            else:
+                results.append(result)
+                progress.update(result['records'])
+
+    elapsed = time.perf_counter() - started
+    signals = sum(result['signals'] for result in results)
+    return {'exports': len(exports),
+            'succeeded': len(results),
+            'failed': failures,
+            'signals': signals,
+            'records': progress.records,
+            'seconds': elapsed,
+            'signals_per_second': signals / elapsed if elapsed else 0.0,
+            'records_per_second': progress.records / elapsed if elapsed else 0.0}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Turn a directory of Google Timeline exports into per-user ZIP activity files')
+    parser.add_argument('exports', help='directory of Timeline exports')
+    parser.add_argument('--out', default='zip_activity_users', help='output directory, one <export name>.json per user')
+    parser.add_argument('--pattern', default='*.json')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--start', help="window start, e.g. '2024-09-18T00:00:00.000-05:00'")
+    parser.add_argument('--end', help='window end (exclusive)')
+    parser.add_argument('--offline', action='store_true', help='only use the local ZIP polygons, never OpenCage')
+    parser.add_argument('--progress-interval', type=float, default=2.0, help='seconds between progress lines')
+    args = parser.parse_args()
+
+    exports = sorted(glob.glob(os.path.join(args.exports, args.pattern)))
+    summary = run(exports, args.out, args.workers, args.start, args.end, not args.offline, args.progress_interval)
+    print(f"{summary['succeeded']}/{summary['exports']} exports, {summary['records']} records in "
+          f"{summary['seconds']:.1f}s ({summary['signals_per_second']:.0f} signals/s, "
+          f"{summary['records_per_second']:.0f} records/s)")
+    for failure in summary['failed']:
+        print(f"failed {failure['export']}: {failure['error']}")
+    sys.exit(1 if summary['failed'] else 0)
@@ -0,0 +1,149 @@
+import cProfile
+import glob
+import hmac
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from datetime import datetime
+
+from flask import g, request
+
+
+# Opt-in cProfile of single requests, saved as <name>.pstats (snakeviz, `python -m pstats`) and
+# <name>.collapsed (flamegraph.pl, speedscope) in HOTSPOT_PROFILE_DIR.
+#
+# HOTSPOT_PROFILE=1 lets a request ask for it with an `X-Profile: 1` header or `?profile=1`.
+# With HOTSPOT_PROFILE_TOKEN set every such request needs `X-Profile-Token: <token>`; without
+# one only loopback addresses may ask, which is only safe with no proxy in front of gunicorn:
+#   curl -H 'X-Profile: 1' -H 'Content-Type: application/json' -d @body.json localhost:8000/app2/_dash-update-component
+# HOTSPOT_PROFILE_RATE=0.01 profiles that share of all requests, asked for or not, and with
+# HOTSPOT_PROFILE_MIN_MS only keeps the ones slower than that. Only the newest
+# HOTSPOT_PROFILE_KEEP profiles are kept in the directory.
+ENABLED = os.environ.get('HOTSPOT_PROFILE', '0') == '1'
+RATE = float(os.environ.get('HOTSPOT_PROFILE_RATE', 0))
+PROFILE_DIR = os.environ.get('HOTSPOT_PROFILE_DIR', '.profiles')
+TOKEN = os.environ.get('HOTSPOT_PROFILE_TOKEN')
+MIN_MS = float(os.environ.get('HOTSPOT_PROFILE_MIN_MS', 0))
+KEEP = int(os.environ.get('HOTSPOT_PROFILE_KEEP', 200))
+
+LOCAL_ADDRESSES = {'127.0.0.1', '::1'}
+
+# one profile at a time per process: cProfile hooks the interpreter, and a second concurrent
+# profile on another thread would fail or double the overhead
+_busy = threading.Lock()
+
+
+def requested():
+    if not ENABLED:
+        return False
+    if request.headers.get('X-Profile') != '1' and request.args.get('profile') != '1':
+        return False
+    if TOKEN:
+        # as bytes: compare_digest refuses str with non-ASCII characters. WSGI hands headers
+        # over decoded as latin-1, so that gives back the bytes the client sent
+        sent = request.headers.get('X-Profile-Token', '').encode('latin-1', 'replace')
+        return hmac.compare_digest(sent, TOKEN.encode('utf-8'))
+    # a reverse proxy on the same host makes every request look local: set a token there
+    return request.remote_addr in LOCAL_ADDRESSES
+
+
+def collapsed_stacks(stats, resolution=1e-6):
+    # cProfile keeps caller -> callee edges, not whole stacks, so stacks are rebuilt from the
+    # roots down, splitting each function's time between its callers by their share of it.
+    # Lines are 'root;...;function microseconds'; paths under `resolution` seconds are dropped.
+    callees = {}
+    for function, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((function, edge[3]))
+    roots = [function for function, entry in stats.items() if not entry[4]]
+    lines = {}
+
+    def label(function):
+        filename, line, name = function
+        return f'{name} ({os.path.basename(filename)}:{line})' if line else name
+
+    def walk(function, path, share):
+        total = stats[function][3]
+        if total * share < resolution:
+            return
+        path = path + (label(function),)
+        own = stats[function][2] * share
+        if own * 1e6 >= 1:
+            key = ';'.join(path)
+            lines[key] = lines.get(key, 0) + own
+        for callee, edge_time in callees.get(function, []):
+            callee_total = stats[callee][3]
+            if label(callee) in path or not total or not callee_total:
+                continue
+            walk(callee, path, share * edge_time / callee_total)
+
+    for root in roots:
+        walk(root, (), 1.0)
+    return [f'{stack} {round(seconds * 1e6)}' for stack, seconds in lines.items() if round(seconds * 1e6)]
+
+
+def save(profiler, seconds):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    target = request.path.strip('/') or 'root'
+    body = request.get_json(silent=True) if request.is_json else None
+    if isinstance(body, dict) and body.get('output'):
+        target += '-' + body['output']
+    target = re.sub(r'[^A-Za-z0-9_.-]+', '_', target)[:80]
+    name = f"{datetime.now():%Y%m%d-%H%M%S.%f}-{os.getpid()}-{target}-{seconds * 1000:.0f}ms"
+    path = os.path.join(PROFILE_DIR, name)
+    profiler.dump_stats(path + '.pstats')
+    with open(path + '.collapsed', 'w') as f:
+        f.write('\n'.join(collapsed_stacks(pstats.Stats(profiler).stats)) + '\n')
+    prune()
+    return name
+
+
+def prune():
+    # drops the oldest profiles past KEEP, so sampling can run for months
+    profiles = sorted(glob.glob(os.path.join(PROFILE_DIR, '*.pstats')), key=os.path.getmtime)
+    for path in profiles[:max(len(profiles) - KEEP, 0)]:
+        for extension in ('.pstats', '.collapsed'):
+            try:
+                os.remove(path[:-len('.pstats')] + extension)
+            except OSError:
+                # another worker pruned it first
+                pass
+
+
+def init_profiling(server):
+    if not ENABLED and not RATE:
+        return
+
+    @server.before_request
+    def start_profile():
+        asked = requested()
+        if not asked and not (RATE and random.random() < RATE):
+            return
+        if not _busy.acquire(blocking=False):
+            return
+        g.profile = (cProfile.Profile(), asked, time.perf_counter())
+        g.profile[0].enable()
+
+    @server.after_request
+    def stop_profile(response):
+        if 'profile' not in g:
+            return response
+        profiler, asked, started = g.pop('profile')
+        profiler.disable()
+        _busy.release()
+        seconds = time.perf_counter() - started
+        if asked or seconds * 1000 >= MIN_MS:
+            name = save(profiler, seconds)
+            if asked:
+                response.headers['X-Profile-File'] = name
+        return response
+
+    @server.teardown_request
+    def drop_profile(exc):
+        # a request that raised never reached stop_profile
+        if 'profile' in g:
+            g.pop('profile')[0].disable()
+            _busy.release()
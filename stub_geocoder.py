@@ -0,0 +1,80 @@
+import argparse
+import asyncio
+import random
+import time
+
+from aiohttp import web
+
+from async_geocoder import AsyncGeocoder
+from zip_lookup import get_resolver
+
+
+# Local stand-in for the OpenCage reverse endpoint (/geocode/v1/json?q=LAT,LON&key=...),
+# answering from the shipped ZIP polygons so geocoding throughput can be measured offline.
+def make_stub_app(latency=0.05, rate=None, error_rate=0.0):
+    resolver = get_resolver()
+    state = {'window': int(time.monotonic()), 'count': 0, 'requests': 0}
+
+    async def reverse(request):
+        state['requests'] += 1
+        if rate is not None:
+            # emulate the provider's per-second quota
+            window = int(time.monotonic())
+            if window != state['window']:
+                state['window'], state['count'] = window, 0
+            state['count'] += 1
+            if state['count'] > rate:
+                return web.json_response({'results': [], 'status': {'code': 429, 'message': 'Too Many Requests'}}, status=429)
+        if error_rate and random.random() < error_rate:
+            return web.json_response({'results': [], 'status': {'code': 503, 'message': 'Service Unavailable'}}, status=503)
+        if latency:
+            await asyncio.sleep(latency)
+
+        # only 'LAT,LON', as OpenCage reads it; anything else is a bad request
+        try:
+            lat, lon = (float(value) for value in request.query['q'].split(','))
+        except (KeyError, ValueError):
+            return web.json_response({'results': [], 'status': {'code': 400, 'message': 'invalid coordinates'}}, status=400)
+        zip_code = resolver.lookup(lat, lon)
+        components = {'country_code': 'us'}
+        if zip_code is not None:
+            components['postcode'] = zip_code
+        return web.json_response({'results': [{'components': components, 'geometry': {'lat': lat, 'lng': lon}}],
+                                  'status': {'code': 200, 'message': 'OK'},
+                                  'total_results': 1})
+
+    app = web.Application()
+    app.router.add_get('/geocode/v1/json', reverse)
+    app['state'] = state
+    return app
+
+
+async def measure(points, concurrency, rate, latency, quota, port):
+    runner = web.AppRunner(make_stub_app(latency=latency, rate=quota))
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', port)
+    await site.start()
+    try:
+        geocoder = AsyncGeocoder(key='stub', url=f'http://127.0.0.1:{port}/geocode/v1/json',
+                                 concurrency=concurrency, rate=rate)
+        coordinates = [(random.uniform(41.65, 42.02), random.uniform(-87.94, -87.52)) for _ in range(points)]
+        start = time.perf_counter()
+        zip_codes = await geocoder.reverse_many(coordinates)
+        elapsed = time.perf_counter() - start
+    finally:
+        await runner.cleanup()
+    print(f'{points} points in {elapsed:.2f}s ({points / elapsed:.1f} points/s), '
+          f'{geocoder.requests} requests, {geocoder.retries} retries, {geocoder.errors} errors, '
+          f'{sum(z is not None for z in zip_codes)} resolved')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure async geocoding throughput against a local OpenCage stub')
+    parser.add_argument('--points', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--rate', type=float, default=200, help='client side requests per second')
+    parser.add_argument('--latency', type=float, default=0.05, help='stub response delay in seconds')
+    parser.add_argument('--quota', type=int, default=None, help='stub requests per second before answering 429')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+    asyncio.run(measure(args.points, args.concurrency, args.rate, args.latency, args.quota, args.port))
@@ -0,0 +1,33 @@
+import numpy as np
+
+from page2 import get_activity_location, get_latest, get_raw, get_semantics, get_zip_code_activity
+from timeline_columns import ZIP_ACTIVITY_DTYPE, format_timestamps, zip_activity_records
+
+
+EXPORT = {'semanticSegments': [{'startTime': '2024-09-18T08:00:00.000-05:00',
+                                'endTime': '2024-09-18T09:00:00.000-05:00',
+                                'visit': {'topCandidate': {'placeLocation': {'latLng': '41.8781°, -87.6298°'}}}}],
+          'rawSignals': [{'position': {'LatLng': '41.8781°, -87.6298°',
+                                       'timestamp': '2024-09-18T08:30:00.000-05:00'}}]}
+
+
+def test_format_timestamps():
+    assert format_timestamps([1726681264000], [-300]).tolist() == ['2024-09-18T12:41:04.000-05:00']
+
+
+def test_format_timestamps_empty():
+    assert format_timestamps([], []).tolist() == []
+    assert format_timestamps(np.array([], dtype='int64'), np.array([], dtype='int64')).tolist() == []
+
+
+def test_zip_activity_records_empty():
+    assert zip_activity_records(np.empty(0, dtype=ZIP_ACTIVITY_DTYPE)) == []
+
+
+def test_empty_window():
+    # a window with no signals in it yields no records instead of failing
+    raw, semantics = get_raw(EXPORT), get_semantics(EXPORT)
+    window_raw, window_semantics = get_latest(raw, semantics, np.int64(0), np.int64(1000))
+    location_activity = get_activity_location(window_raw, window_semantics)
+    zip_activity = get_zip_code_activity(window_raw, window_semantics, location_activity, fallback=False)
+    assert zip_activity_records(zip_activity) == []
@@ -0,0 +1,50 @@
+import io
+import json
+
+import pytest
+
+from timeline_stream import _Reader, iter_timeline
+
+
+EXPORT = {'version': 1.25,
+          'semanticSegments': [{'startTime': '2024-09-18T08:00:00.000-05:00',
+                                'endTime': '2024-09-18T09:00:00.000-05:00',
+                                'visit': {'probability': 0.875,
+                                          'topCandidate': {'placeLocation': {'latLng': '41.8781°, -87.6298°'}}}}],
+          'rawSignals': [{'position': {'LatLng': '41.8781°, -87.6298°', 'accuracyMeters': 12345,
+                                       'timestamp': '2024-09-18T08:30:00.000-05:00'}}],
+          'count': -2.5e-3,
+          'done': True,
+          'extra': None}
+
+
+class Chunks:
+    # a text stream that hands out the given pieces one read at a time
+    def __init__(self, *pieces):
+        self.pieces = list(pieces)
+
+    def read(self, size):
+        return self.pieces.pop(0) if self.pieces else ''
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 14, 1 << 20])
+def test_values_split_across_chunks(chunk_size):
+    # every value read through a reader refilling `chunk_size` characters at a time
+    text = json.dumps(EXPORT, ensure_ascii=False)
+    reader = _Reader(io.StringIO(text), chunk_size)
+    assert reader.value() == EXPORT
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 7, 14])
+def test_number_split_after_integer_part(chunk_size):
+    text = json.dumps(EXPORT, ensure_ascii=False)
+    records = list(iter_timeline(io.StringIO(text), chunk_size=chunk_size))
+    assert records == list(iter_timeline(io.StringIO(text)))
+    assert [kind for kind, _ in records] == ['semantic', 'raw']
+
+
+@pytest.mark.parametrize('number', ['1.25', '-0.5', '12e3', '1E-2', '100'])
+def test_number_at_every_split(number):
+    text = '{"a": ' + number + ', "b": [' + number + ']}'
+    for split in range(1, len(text)):
+        assert _Reader(Chunks(text[:split], text[split:])).value() == json.loads(text)
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MILLISECOND = timedelta(milliseconds=1)
+
+# which window edges are included: 'left' is [start, end), 'both' is [start, end]
+CLOSED = {'left': ('left', 'left'),
+          'right': ('right', 'right'),
+          'both': ('left', 'right'),
+          'neither': ('right', 'left')}
+
+
+def parse_epoch(timestamp):
+    # '2024-09-18T12:41:04.000-05:00' -> epoch milliseconds (UTC)
+    return (datetime.fromisoformat(timestamp) - EPOCH) // MILLISECOND
+
+
+def to_epochs(timestamps):
+    # fromisoformat is several times faster than pd.to_datetime on offset-aware strings
+    return np.fromiter((parse_epoch(timestamp) for timestamp in timestamps), dtype='int64', count=len(timestamps))
+
+
+def to_epoch(timestamp):
+    if isinstance(timestamp, (int, np.integer)):
+        return int(timestamp)
+    return parse_epoch(timestamp)
+
+
+class TimeIndex:
+    # sorted epoch array over a list of records, queried with binary search
+    def __init__(self, epochs):
+        epochs = np.asarray(epochs, dtype='int64')
+        if len(epochs) > 1 and np.any(epochs[1:] < epochs[:-1]):
+            # exports are nearly but not always sorted; keep a stable order for the rest
+            self.order = np.argsort(epochs, kind='stable')
+            self.epochs = epochs[self.order]
+        else:
+            self.order = None
+            self.epochs = epochs
+
+    @classmethod
+    def from_records(cls, records, key):
+        return cls(to_epochs([record[key] for record in records]))
+
+    def __len__(self):
+        return len(self.epochs)
+
+    def bounds(self, start, end, closed='left'):
+        # positions [lo, hi) of the sorted epochs inside the window
+        lo_side, hi_side = CLOSED[closed]
+        lo = int(np.searchsorted(self.epochs, to_epoch(start), side=lo_side))
+        hi = int(np.searchsorted(self.epochs, to_epoch(end), side=hi_side))
+        return lo, max(lo, hi)
+
+    def bounds_many(self, starts, ends, closed='left'):
+        lo_side, hi_side = CLOSED[closed]
+        starts = np.array([to_epoch(s) for s in starts], dtype='int64')
+        ends = np.array([to_epoch(e) for e in ends], dtype='int64')
+        lo = np.searchsorted(self.epochs, starts, side=lo_side)
+        hi = np.searchsorted(self.epochs, ends, side=hi_side)
+        return lo, np.maximum(lo, hi)
+
+    def take(self, records, lo, hi):
+        # the records inside [lo, hi), in time order
+        if self.order is None:
+            return records[lo:hi]
+        if isinstance(records, np.ndarray):
+            return records[self.order[lo:hi]]
+        return [records[i] for i in self.order[lo:hi]]
@@ -0,0 +1,175 @@
+import enum
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from time_window import EPOCH, MILLISECOND
+
+
+class RawKind(enum.IntEnum):
+    ACTIVITY = 0
+    WIFI = 1
+    POSITION = 2
+
+
+class SemanticKind(enum.IntEnum):
+    STAY = 0
+    TRAVEL = 1
+
+
+RAW_KINDS = {'travel': RawKind.ACTIVITY, 'wifiscan': RawKind.WIFI, 'positionscan': RawKind.POSITION}
+SEMANTIC_KINDS = {'stay': SemanticKind.STAY, 'travel': SemanticKind.TRAVEL}
+
+# categorical codes for activity / record types; names not listed here get appended on first use
+ACTIVITY_TYPES = ['UNKNOWN', 'positionscan', 'wifiscan', 'STILL', 'WALKING', 'ON_FOOT', 'RUNNING', 'ON_BICYCLE',
+                  'IN_ROAD_VEHICLE', 'IN_RAIL_VEHICLE', 'IN_VEHICLE', 'IN_BUS', 'IN_PASSENGER_VEHICLE',
+                  'IN_SUBWAY', 'IN_TRAIN', 'IN_TRAM', 'FLYING', 'CYCLING', 'MOTORCYCLING', 'TILTING',
+                  'EXITING_VEHICLE']
+_ACTIVITY_CODES = {name: code for code, name in enumerate(ACTIVITY_TYPES)}
+NO_ACTIVITY = -1
+
+# epochs are UTC milliseconds, tz_offset keeps the export's local offset in minutes
+RAW_DTYPE = np.dtype([('kind', 'i1'),
+                      ('timestamp', 'i8'),
+                      ('tz_offset', 'i2'),
+                      ('lat', 'f8'),
+                      ('lon', 'f8'),
+                      ('activity', 'i2')])
+
+# stays keep the place in lat/lon; travel keeps its start in lat/lon and its end in end_lat/end_lon
+SEMANTIC_DTYPE = np.dtype([('kind', 'i1'),
+                           ('start', 'i8'),
+                           ('end', 'i8'),
+                           ('tz_offset', 'i2'),
+                           ('lat', 'f8'),
+                           ('lon', 'f8'),
+                           ('end_lat', 'f8'),
+                           ('end_lon', 'f8'),
+                           ('activity', 'i2')])
+
+ZIP_ACTIVITY_DTYPE = np.dtype([('timestamp', 'i8'),
+                               ('tz_offset', 'i2'),
+                               ('type', 'i2'),
+                               ('zipcode', 'U10')])
+
+CHUNK_ROWS = 65536
+
+
+def activity_code(name):
+    code = _ACTIVITY_CODES.get(name)
+    if code is None:
+        code = _ACTIVITY_CODES[name] = len(ACTIVITY_TYPES)
+        ACTIVITY_TYPES.append(name)
+    return code
+
+
+def activity_names(codes):
+    names = np.array(ACTIVITY_TYPES + [None], dtype=object)
+    return names[np.asarray(codes)]
+
+
+def parse_time(timestamp):
+    # -> (epoch milliseconds, utc offset minutes)
+    parsed = datetime.fromisoformat(timestamp)
+    return (parsed - EPOCH) // MILLISECOND, parsed.utcoffset() // timedelta(minutes=1)
+
+
+def _build(rows, dtype):
+    # fill the array a chunk at a time so at most CHUNK_ROWS tuples are alive at once
+    chunks = []
+    pending = []
+    for row in rows:
+        pending.append(row)
+        if len(pending) == CHUNK_ROWS:
+            chunks.append(np.array(pending, dtype=dtype))
+            pending = []
+    chunks.append(np.array(pending, dtype=dtype))
+    return np.concatenate(chunks)
+
+
+def raw_array(records):
+    # timeline_stream raw records -> RAW_DTYPE array
+    def rows():
+        for record in records:
+            epoch, offset = parse_time(record['timestamp'])
+            kind = RAW_KINDS[record['type']]
+            if kind == RawKind.POSITION:
+                yield kind, epoch, offset, record['lat'], record['long'], NO_ACTIVITY
+            elif kind == RawKind.ACTIVITY:
+                yield kind, epoch, offset, np.nan, np.nan, activity_code(record['activity'])
+            else:
+                yield kind, epoch, offset, np.nan, np.nan, NO_ACTIVITY
+    return _build(rows(), RAW_DTYPE)
+
+
+def semantics_array(records):
+    # timeline_stream semantic records -> SEMANTIC_DTYPE array
+    def rows():
+        for record in records:
+            start, offset = parse_time(record['start'])
+            end, _ = parse_time(record['end'])
+            if SEMANTIC_KINDS[record['type']] == SemanticKind.STAY:
+                yield SemanticKind.STAY, start, end, offset, record['lat'], record['long'], np.nan, np.nan, NO_ACTIVITY
+            else:
+                yield (SemanticKind.TRAVEL, start, end, offset, record['start_lat'], record['start_long'],
+                       record['end_lat'], record['end_long'], activity_code(record['activity']))
+    return _build(rows(), SEMANTIC_DTYPE)
+
+
+def format_timestamps(epochs, offsets):
+    # epoch ms + offset minutes -> '2024-09-18T12:41:04.000-05:00', vectorized
+    epochs = np.asarray(epochs, dtype='int64')
+    offsets = np.asarray(offsets, dtype='int64')
+    if not epochs.size:
+        # np.char.zfill can't take an empty array (a window with no matched signals)
+        return np.array([], dtype='U29')
+    local = (epochs + offsets * 60000).astype('datetime64[ms]')
+    sign = np.where(offsets < 0, '-', '+')
+    hours, minutes = np.divmod(np.abs(offsets), 60)
+    suffix = np.char.add(np.char.add(np.char.add(sign, np.char.zfill(hours.astype('U2'), 2)), ':'),
+                         np.char.zfill(minutes.astype('U2'), 2))
+    return np.char.add(np.datetime_as_string(local, unit='ms'), suffix)
+
+
+def to_frame(array):
+    # structured array -> DataFrame with readable kinds, UTC timestamps and categorical activities
+    frame = pd.DataFrame({name: array[name] for name in array.dtype.names})
+    for column in ('timestamp', 'start', 'end'):
+        if column in frame:
+            frame[column] = pd.to_datetime(frame[column], unit='ms', utc=True)
+    if 'kind' in frame:
+        kinds = RawKind if array.dtype == RAW_DTYPE else SemanticKind
+        frame['kind'] = pd.Categorical.from_codes(frame['kind'], [kind.name for kind in kinds])
+    for column in ('activity', 'type'):
+        if column in frame:
+            frame[column] = pd.Categorical.from_codes(frame[column], list(ACTIVITY_TYPES))
+    return frame
+
+
+def from_frame(frame, dtype):
+    # inverse of to_frame
+    array = np.empty(len(frame), dtype=dtype)
+    for name in dtype.names:
+        column = frame[name]
+        if pd.api.types.is_datetime64_any_dtype(column):
+            if column.dt.tz is not None:
+                column = column.dt.tz_convert('UTC').dt.tz_localize(None)
+            array[name] = column.to_numpy(dtype='datetime64[ms]').astype('int64')
+        elif isinstance(column.dtype, pd.CategoricalDtype):
+            if name == 'kind':
+                kinds = RawKind if dtype == RAW_DTYPE else SemanticKind
+                array[name] = [kinds[value] for value in column.astype(str)]
+            else:
+                array[name] = [NO_ACTIVITY if pd.isna(value) else activity_code(value) for value in column]
+        else:
+            array[name] = column.to_numpy()
+    return array
+
+
+def zip_activity_records(zip_activity):
+    # ZIP_ACTIVITY_DTYPE array -> the list of dicts written to data_18_24.json
+    timestamps = format_timestamps(zip_activity['timestamp'], zip_activity['tz_offset'])
+    types = activity_names(zip_activity['type'])
+    return [{'timestamp': timestamp, 'type': record_type, 'zipcode': zipcode if zipcode else None}
+            for timestamp, record_type, zipcode in zip(timestamps.tolist(), types.tolist(), zip_activity['zipcode'].tolist())]
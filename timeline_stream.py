@@ -0,0 +1,183 @@
+import collections
+import json
+
+
+CHUNK_SIZE = 1 << 20
+WHITESPACE = ' \t\n\r'
+DELIMITERS = WHITESPACE + ',]}'
+
+
+def parse_latlng(value):
+    # '41.8781°, -87.6298°' -> (41.8781, -87.6298)
+    lat, lon = value.replace('°', '').split(',')
+    return float(lat), float(lon)
+
+
+def semantic_record(segment):
+    # returns the flattened record, or None for segments we don't use
+    if 'timelinePath' in segment:
+        return None
+    if 'visit' in segment:
+        lat, lon = parse_latlng(segment['visit']['topCandidate']['placeLocation']['latLng'])
+        return {'start':segment['startTime'],
+                'end':segment['endTime'],
+                'lat':lat,
+                'long':lon,
+                'type':'stay'}
+    if 'activity' in segment:
+        start_lat, start_lon = parse_latlng(segment['activity']['start']['latLng'])
+        end_lat, end_lon = parse_latlng(segment['activity']['end']['latLng'])
+        return {'start':segment['startTime'],
+                'end':segment['endTime'],
+                'activity':segment['activity']['topCandidate']['type'],
+                'start_lat':start_lat,
+                'end_lat':end_lat,
+                'start_long':start_lon,
+                'end_long':end_lon,
+                'type':'travel'}
+    raise KeyError('unknown semantic segment')
+
+
+def raw_record(signal):
+    if 'activityRecord' in signal:
+        return {'activity':signal['activityRecord']['probableActivities'][0]['type'],
+                'timestamp':signal['activityRecord']['timestamp'],
+                'type':'travel'}
+    if 'wifiScan' in signal:
+        return {'timestamp':signal['wifiScan']['deliveryTime'],
+                'type':'wifiscan'}
+    if 'position' in signal:
+        lat, lon = parse_latlng(signal['position']['LatLng'])
+        return {'timestamp':signal['position']['timestamp'],
+                'lat':lat,
+                'long':lon,
+                'type':'positionscan'}
+    raise KeyError('unknown raw signal')
+
+
+def convert(kind, item, stats):
+    # turn one export item into a record, counting anything we have to skip
+    try:
+        if kind == 'semantic':
+            record = semantic_record(item)
+            if record is None:
+                stats['semantic_skipped'] += 1
+                return None
+        else:
+            record = raw_record(item)
+    except (KeyError, IndexError, TypeError, ValueError, AttributeError):
+        stats[kind + '_unknown'] += 1
+        return None
+    stats[kind] += 1
+    return record
+
+
+class _Reader:
+    # incremental JSON tokenizer over a text stream; only one array item is held in memory at a time
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self):
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f'expected {char!r} at offset {self.pos} of the current chunk')
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # a number or literal cut by the chunk edge decodes as its first part ('1.' of '1.25'):
+            # it is only whole once a delimiter follows it
+            cut = end == len(self.buf) or self.buf[end] not in DELIMITERS
+            if cut and not isinstance(value, (dict, list, str)) and not self.eof and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def items(self):
+        # iterate the items of the array starting at the current position
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            char = self.peek()
+            self.pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError(f'expected , or ] but found {char!r}')
+
+
+def iter_timeline(source, keys=('semanticSegments', 'rawSignals'), stats=None, chunk_size=CHUNK_SIZE):
+    # yields ('semantic', record) and ('raw', record) in file order from a Timeline export
+    # path or text file, without loading the whole document
+    if stats is None:
+        stats = collections.Counter()
+    if isinstance(source, (str, bytes)) or hasattr(source, '__fspath__'):
+        with open(source, 'r', encoding='utf-8') as f:
+            yield from iter_timeline(f, keys, stats, chunk_size)
+        return
+
+    kinds = {'semanticSegments': 'semantic', 'rawSignals': 'raw'}
+    reader = _Reader(source, chunk_size)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if reader.peek() == '[':
+            for item in reader.items():
+                # arrays we were not asked for are still walked item by item, never held whole
+                if key in keys and key in kinds:
+                    record = convert(kinds[key], item, stats)
+                    if record is not None:
+                        yield kinds[key], record
+        else:
+            reader.value()
+        char = reader.peek()
+        reader.pos += 1
+        if char == '}':
+            return
+        if char != ',':
+            raise ValueError(f'expected , or }} but found {char!r}')
+
+
+def iter_semantics(source, stats=None, chunk_size=CHUNK_SIZE):
+    for _, record in iter_timeline(source, ('semanticSegments',), stats, chunk_size):
+        yield record
+
+
+def iter_raw(source, stats=None, chunk_size=CHUNK_SIZE):
+    for _, record in iter_timeline(source, ('rawSignals',), stats, chunk_size):
+        yield record
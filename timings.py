@@ -0,0 +1,24 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+# seconds spent in each startup phase of this process, in the order they finished
+STARTUP_PHASES = {}
+_lock = threading.Lock()
+
+
+@contextmanager
+def phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            STARTUP_PHASES[name] = time.perf_counter() - started
+
+
+def report(prefix='startup'):
+    with _lock:
+        phases = ', '.join(f'{name} {seconds * 1000:.0f}ms' for name, seconds in STARTUP_PHASES.items())
+    print(f'{prefix}: {phases}', flush=True)
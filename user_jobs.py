@@ -0,0 +1,92 @@
+import base64
+import collections
+import hashlib
+import json
+import os
+import threading
+
+import diskcache
+from dash import DiskcacheManager
+
+from exposure import Exposure
+
+
+# Uploaded Timeline exports are scored by Dash background callbacks. Jobs and their results
+# live in one on-disk cache shared by every gunicorn worker, so no broker is needed.
+JOB_CACHE_DIR = os.environ.get('HOTSPOT_JOB_CACHE', '.jobs')
+# how long a scored upload is kept, in seconds
+RESULT_TTL = float(os.environ.get('HOTSPOT_RESULT_TTL', 7 * 24 * 3600))
+# scored uploads kept in memory per process
+MEMORY_ENTRIES = 32
+
+_job_cache = None
+_exposures = collections.OrderedDict()
+_exposures_lock = threading.Lock()
+
+
+def get_job_cache():
+    global _job_cache
+    if _job_cache is None:
+        _job_cache = diskcache.Cache(JOB_CACHE_DIR)
+    return _job_cache
+
+
+def get_background_manager():
+    return DiskcacheManager(get_job_cache(), expire=RESULT_TTL)
+
+
+def upload_digest(contents, partition=''):
+    # identifies an upload by its bytes and the partition it's scored against, so
+    # re-uploading the same export is free
+    return hashlib.sha256(f'{partition}:{contents}'.encode()).hexdigest()
+
+
+def decode_upload(contents):
+    # dcc.Upload contents: 'data:<mime>;base64,<payload>'
+    _, payload = contents.split(',', 1)
+    return json.loads(base64.b64decode(payload))
+
+
+def score_export(data, spec, pop_dict, weekly_cases, progress=None, fallback=True):
+    # the same pipeline as prepare_data.process_export, straight into an Exposure; ZIPs come
+    # from the partition's polygons and only those in its zip_range are scored
+    from page2 import get_raw, get_semantics, get_activity_location, get_zip_code_activity
+    from timeline_columns import zip_activity_records
+
+    def report(step, text):
+        if progress is not None:
+            progress(step, text)
+
+    report(1, 'Reading the export')
+    stats = collections.Counter()
+    semantics = get_semantics(data, stats)
+    raw = get_raw(data, stats)
+    report(2, f'Matching {len(raw)} signals to places')
+    location_activity = get_activity_location(raw, semantics)
+    report(3, 'Resolving ZIP codes')
+    zip_activity = get_zip_code_activity(raw, semantics, location_activity, fallback, directory=spec['geojson_dir'])
+    report(4, f'Scoring {len(zip_activity)} records')
+    return Exposure.from_records(zip_activity_records(zip_activity), pop_dict, weekly_cases,
+                                 max_zip=spec['zip_range'][1])
+
+
+def save_exposure(digest, exposure):
+    get_job_cache().set(('exposure', digest), (exposure.first_day, exposure.sums, exposure.counts),
+                        expire=RESULT_TTL)
+
+
+def load_exposure(digest):
+    # None when the upload was never scored or its result expired
+    with _exposures_lock:
+        if digest in _exposures:
+            _exposures.move_to_end(digest)
+            return _exposures[digest]
+    stored = get_job_cache().get(('exposure', digest))
+    if stored is None:
+        return None
+    exposure = Exposure(*stored)
+    with _exposures_lock:
+        _exposures[digest] = exposure
+        while len(_exposures) > MEMORY_ENTRIES:
+            _exposures.popitem(last=False)
+    return exposure
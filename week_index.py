@@ -0,0 +1,42 @@
+import numpy as np
+
+
+class WeekIndex:
+    # O(1) per-week lookups over app2's tables, built once per data version so
+    # callbacks never scan a whole DataFrame
+    def __init__(self, datasets):
+        df = datasets['df']
+        df1 = datasets['df1']
+        age_df = datasets['age_df']
+
+        # risk levels: rows grouped by week (stable, so each week keeps its Week_Start order)
+        # and a row range per week into the grouped frame
+        order = np.argsort(df1['MMWR_Week'].to_numpy(), kind='stable')
+        self.risk_rows = df1.iloc[order].reset_index(drop=True)
+        weeks = self.risk_rows['MMWR_Week'].to_numpy()
+        starts = np.flatnonzero(np.r_[True, weeks[1:] != weeks[:-1]]) if len(weeks) else np.array([], dtype='int64')
+        stops = np.r_[starts[1:], len(weeks)]
+        self.risk_ranges = {int(weeks[start]): (int(start), int(stop)) for start, stop in zip(starts, stops)}
+
+        # weekly lab-tested cases
+        self.cases = {int(week): int(cases) for week, cases in zip(df['week'], df['LAB_FLU_TESTED'])}
+
+        # age group with the highest weekly rate in each week
+        top = age_df.loc[age_df.groupby('mmwr-week', sort=False)['weekly rate'].idxmax()]
+        self.top_age = {int(week): str(age) for week, age in zip(top['mmwr-week'], top['age category'])}
+
+    def risk(self, week):
+        start, stop = self.risk_ranges.get(int(week), (0, 0))
+        return self.risk_rows.iloc[start:stop]
+
+    def zip_ili(self, week, zip_code):
+        # first ILI reading for the ZIP in that week, None without one
+        rows = self.risk(week)
+        values = rows['ILI'].to_numpy()[rows['ZIP_Code'].to_numpy() == zip_code]
+        return float(values[0]) if len(values) else None
+
+    def weekly_cases(self, week):
+        return self.cases.get(int(week))
+
+    def previous_cases(self, week):
+        return self.cases.get(int(week) - 1)
@@ -0,0 +1,70 @@
+import json
+import os
+import threading
+
+import numpy as np
+import shapely
+from shapely.geometry import shape
+from shapely.strtree import STRtree
+
+
+class ZipResolver:
+    # Offline reverse geocoder over the ZIP polygons shipped in geojson/
+    def __init__(self, geojson_dir='geojson', key='postal-code'):
+        geometries = []
+        zip_codes = []
+        for filename in sorted(os.listdir(geojson_dir)):
+            if not filename.endswith('.geojson'):
+                continue
+            with open(os.path.join(geojson_dir, filename)) as f:
+                geojson_data = json.load(f)
+            for feature in geojson_data['features']:
+                # every file also carries a label Point with empty properties
+                if key not in feature['properties']:
+                    continue
+                if feature['geometry']['type'] not in ('Polygon', 'MultiPolygon'):
+                    continue
+                geometries.append(shape(feature['geometry']))
+                zip_codes.append(feature['properties'][key])
+
+        self.geometries = np.array(geometries, dtype=object)
+        self.zip_codes = np.array(zip_codes, dtype=object)
+        shapely.prepare(self.geometries)
+        self.tree = STRtree(self.geometries)
+
+    def __len__(self):
+        return len(self.zip_codes)
+
+    def lookup(self, lat, lon):
+        return self.lookup_many([lat], [lon])[0]
+
+    def lookup_many(self, lats, lons):
+        # returns an object array of ZIP strings, None where no polygon matches
+        lats = np.asarray(lats, dtype='float64')
+        lons = np.asarray(lons, dtype='float64')
+        result = np.full(len(lats), None, dtype=object)
+        if len(lats) == 0:
+            return result
+
+        points = shapely.points(lons, lats)
+        # 'intersects' so points exactly on a border still resolve
+        point_idx, polygon_idx = self.tree.query(points, predicate='intersects')
+        # a border point can match two polygons, keep the first one
+        point_idx, first = np.unique(point_idx, return_index=True)
+        result[point_idx] = self.zip_codes[polygon_idx[first]]
+        return result
+
+
+_resolvers = {}
+_resolvers_lock = threading.Lock()
+
+
+def get_resolver(geojson_dir='geojson'):
+    # one resolver per directory, built on first use
+    resolver = _resolvers.get(geojson_dir)
+    if resolver is None:
+        with _resolvers_lock:
+            resolver = _resolvers.get(geojson_dir)
+            if resolver is None:
+                resolver = _resolvers[geojson_dir] = ZipResolver(geojson_dir)
+    return resolver